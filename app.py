@@ -6,14 +6,16 @@
 
 # Basic Flask functionality, importing modules for parsing results and accessing MySQL. 
 
-from calendar import c
-from flask import Flask, render_template, request, json, flash, redirect, url_for, g
+from flask import Flask, render_template, request, json, flash, redirect, url_for, g, jsonify
+from flask import Response, abort, before_render_template, template_rendered
 from flask_login import login_user, logout_user, current_user
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 import static.py.VLE_graph as vle
+from static.py.heat_duty import PLANT_DEFAULTS, check_plant
+from static.py.optimize import feed_quality
+from static.py.VLE_models import ANALYTIC_MODELS, analytic_curve
+import math
 import os
+import time
 
 from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy 
@@ -21,9 +23,18 @@ from werkzeug.utils import secure_filename
 from werkzeug.security import check_password_hash
 
 from database.extensions import db, login_manager
-from database.commands import upload_component, upload_vle, get_vle_from_components
-from database.commands import get_user_vle_dict, delete_user_data
-from database.models import User, Component, VleData
+from database.cache import curve_cache, graph_cache, component_cache, stage_cache, temperature_cache
+from database.cache import reflux_cache
+from database.commands import upload_component, upload_vle, get_vle_graph, get_vle_stages
+from database.commands import get_vle_stages_batch, get_vle_cost, get_reflux_optimum, get_feed_optimum
+from database.commands import get_minimum_reflux
+from database.commands import get_graph_key, dataset_exists, search_components
+from database.commands import drop_and_create_tables, migrate_points, migrate_datasets
+from database.commands import get_user_datasets, delete_user_data, upload_vle_model
+from database.jobs import parse_job_params, submit_job, get_job, cancel_job, job_expired
+from database.jobs import purge_jobs, run_queued_jobs
+from database.models import User, Component
+from database import metrics
 
 # Set up application and the necessary environment variables
 app = Flask(__name__)
@@ -40,10 +51,41 @@ except:
 # Turn off modification tracking
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+# Seconds browsers and proxies may reuse a graph before revalidating it
+app.config['GRAPH_MAX_AGE'] = int(os.getenv('GRAPH_MAX_AGE', 300))
+# Largest batch accepted by the calculation API, and the batch size above
+# which it is spread across the process pool
+app.config['API_MAX_CASES'] = int(os.getenv('API_MAX_CASES', 1000))
+app.config['API_POOL_THRESHOLD'] = int(os.getenv('API_POOL_THRESHOLD', 256))
+# Datasets listed per page of the user profile
+app.config['PROFILE_PAGE_SIZE'] = int(os.getenv('PROFILE_PAGE_SIZE', 20))
+# Worker processes for background jobs, and seconds their results are kept
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+app.config['JOB_RESULT_TTL'] = int(os.getenv('JOB_RESULT_TTL', 24 * 60 * 60))
+# Equilibrium curve model datasets are fitted with, see vle.CURVE_MODELS
+app.config['VLE_CURVE_MODEL'] = os.getenv('VLE_CURVE_MODEL', 'polyfit')
+# Stages stepped off before a design is taken as infeasible
+app.config['MAX_STAGES'] = int(os.getenv('MAX_STAGES', vle.MAX_STAGES))
+# Report the time spent in each phase of a request in the Server-Timing header
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', '1') == '1'
+# SQL statements slower than SLOW_QUERY_MS are logged, as are requests running
+# more than QUERY_BUDGET statements. QUERY_DEBUG_HEADER adds the count and
+# time of a request's statements to its response as X-Query-Count
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 100))
+app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', 20))
+app.config['QUERY_DEBUG_HEADER'] = os.getenv('QUERY_DEBUG_HEADER', '0') == '1'
 # Connect to database
 db.init_app(app)
 # Initialize login manager for the application
 login_manager.init_app(app)
+# Database commands, run with `flask <command>`
+app.cli.add_command(drop_and_create_tables)
+app.cli.add_command(migrate_points)
+app.cli.add_command(migrate_datasets)
+app.cli.add_command(purge_jobs)
+app.cli.add_command(run_queued_jobs)
+# Count and time every SQL statement
+metrics.track_queries(app.logger, app.config['SLOW_QUERY_MS'] / 1000)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -52,51 +94,457 @@ def load_user(user_id):
     except:
         return None
 
+# -------------------------------------------------------------------------------------------------
+# Request timing and SQL counts, reported in response headers and on /metrics
+# -------------------------------------------------------------------------------------------------
+@app.before_request
+def start_timing():
+    metrics.start_request()
+
+
+@app.after_request
+def finish_timing(response):
+    endpoint = request.endpoint or 'none'
+    spans, total = metrics.finish_request(endpoint, request.method, response.status_code)
+    queries = metrics.finish_queries(endpoint)
+
+    if queries.count > app.config['QUERY_BUDGET']:
+        app.logger.warning('%s %s ran %d SQL statements, over the budget of %d. Most repeated: %s',
+                           request.method, request.path, queries.count, app.config['QUERY_BUDGET'],
+                           queries.repeated[:3])
+
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = metrics.server_timing(spans, total)
+    if app.config['QUERY_DEBUG_HEADER'] or app.debug:
+        response.headers['X-Query-Count'] = '{}; time={:.2f}ms'.format(queries.count, queries.seconds * 1000)
+
+    return response
+
+
+@before_render_template.connect_via(app)
+def start_render(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def finish_render(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        metrics.record('render', time.perf_counter() - start)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
 # -------------------------------------------------------------------------------------------------
 # Main Index page 
 # -------------------------------------------------------------------------------------------------
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    # Query for components list in alphabetical order
-    components = Component.query.order_by(Component.name).all()
-    vle_table = VleData.query.order_by(VleData.id).all()
-    
     if request.method == 'POST':
         # Reset page if anything is not in the form
-        if ('component1' not in request.form or 'component2' not in request.form
-            or 'mole_frac_feed' not in request.form
-            or 'mole_frac_dist' not in request.form
-            or 'mole_frac_bot' not in request.form
-            or 'reflux_ratio' not in request.form
-            or 'quality' not in request.form):
+        if (not request.form.get('component1') or not request.form.get('component2')
+            or not request.form.get('mole_frac_feed')
+            or not request.form.get('mole_frac_dist')
+            or not request.form.get('mole_frac_bot')
+            or not request.form.get('reflux_ratio')
+            or not request.form.get('quality')):
             flash('Please enter a value for all items in the distillation calculator')
-            return render_template('index.html', components=components)
+            return render_template('index.html')
 
         # Get vle data and query for it
         component1_id = request.form['component1']
         component2_id = request.form['component2']
 
-        VLE_data = get_vle_from_components(component1_id, component2_id)
-
         # Get data from form
         xF = float(request.form['mole_frac_feed'])
         xD = float(request.form['mole_frac_dist'])
         xB = float(request.form['mole_frac_bot'])
         R = float(request.form['reflux_ratio'])
         q = float(request.form['quality'])
-        
-        # Create plot based on inputs
-        vle_plot_url, nstage = vle.do_graph(VLE_data, xF, xD, xB, R, q) 
-        if vle_plot_url == "Error":
+
+        design_error = vle.check_design(xF, xD, xB, R, q)
+        if design_error:
+            flash(design_error)
+            return render_template('index.html')
+
+        # Step off the stages now, the graph is loaded from its own url
+        result = get_vle_stages(component1_id, component2_id, xF, xD, xB, R, q)
+        if result is None:
+            flash('There is no data for this combination of components')
+            return render_template('index.html')
+
+        if result.pinch is not None:
+            R_min = get_minimum_reflux(component1_id, component2_id, xF, xD, xB, R, q)
+            flash(vle.describe_pinch(result.pinch, R_min) + ', enter new values')
+            return render_template('index.html')
+        if result.nstage >= app.config['MAX_STAGES']:
             flash('Parameters resulted in invalid calculation, enter new values')
-            return render_template('index.html', components=components)
+            return render_template('index.html')
         else:
-            plot = '<img class="img-responsive" src="data:image/png;base64,{}">'.format(vle_plot_url)
-            return render_template('index.html', plot=plot, graph_requested=True,
-                                    nstage=nstage, components=components)
+            plot_url = url_for('graph', fmt='png', component1=component1_id,
+                               component2=component2_id, xF=xF, xD=xD, xB=xB, R=R, q=q)
+            return render_template('index.html', plot_url=plot_url, graph_requested=True,
+                                    nstage=result.nstage)
 
     # Load page normally
-    return render_template('index.html', components=components)   
+    return render_template('index.html')   
+
+
+# -------------------------------------------------------------------------------------------------
+# Component typeahead search
+# -------------------------------------------------------------------------------------------------
+@app.route('/api/v1/components')
+def component_search():
+    query = request.args.get('q', '')
+    partner_id = request.args.get('partner', type=int)
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+
+    components = search_components(query, partner_id, limit)
+
+    return jsonify(components=[{'id': id, 'name': name} for id, name in components])
+
+
+# -------------------------------------------------------------------------------------------------
+# McCabe-Thiele calculations for a batch of designs
+# -------------------------------------------------------------------------------------------------
+DESIGN_FIELDS = ('xF', 'xD', 'xB', 'R', 'q')
+
+@app.route('/api/v1/stages', methods=['POST'])
+def api_stages():
+    body = request.get_json(silent=True) or {}
+    cases = body.get('cases')
+
+    if not isinstance(cases, list) or not cases:
+        return jsonify(error='Send a non-empty list of cases'), 400
+    if len(cases) > app.config['API_MAX_CASES']:
+        return jsonify(error='At most {} cases per request'.format(app.config['API_MAX_CASES'])), 413
+
+    # Check every case, only the valid ones are calculated
+    results = [None] * len(cases)
+    valid = []
+    for index, case in enumerate(cases):
+        try:
+            component_ids = [int(case['component1']), int(case['component2'])]
+            design = [float(case[name]) for name in DESIGN_FIELDS]
+        except (KeyError, TypeError, ValueError):
+            results[index] = {'error': 'Each case needs component1, component2, xF, xD, xB, R and q'}
+            continue
+
+        design_error = vle.check_design(*design)
+        if design_error:
+            results[index] = {'error': design_error}
+        else:
+            valid.append((index, tuple(component_ids + design)))
+
+    stages = get_vle_stages_batch([case for _, case in valid], app.config['API_POOL_THRESHOLD'])
+    for (index, case), result in zip(valid, stages):
+        results[index] = stage_result_json(result, case)
+
+    return jsonify(results=results)
+
+
+def stage_result_json(result, case):
+    """
+    JSON form of the StageResult of case, or the reason there is none
+    """
+    if result is None:
+        return {'error': 'There is no data for this combination of components'}
+    if result.pinch is not None:
+        R_min = get_minimum_reflux(*case)
+        return {'error': vle.describe_pinch(result.pinch, R_min),
+                'pinch': {'x': result.pinch.x, 'y': result.pinch.y, 'R_min': R_min}}
+    if result.nstage >= app.config['MAX_STAGES']:
+        return {'error': 'Parameters resulted in invalid calculation'}
+
+    return {
+        'nstage': result.nstage,
+        'feed_stage': result.feed_stage,
+        'x': result.x.tolist(),
+        'y': result.y.tolist()
+    }
+
+
+# -------------------------------------------------------------------------------------------------
+# Break-even cost of the column built from a design
+# -------------------------------------------------------------------------------------------------
+@app.route('/api/v1/cost', methods=['POST'])
+def api_cost():
+    body = request.get_json(silent=True) or {}
+
+    # Plant data not given is taken from the 2019 ethanol-water design
+    try:
+        component_ids = [int(body['component1']), int(body['component2'])]
+        design = [float(body[name]) for name in DESIGN_FIELDS]
+        plant = {name: float(body.get(name, default)) for name, default in PLANT_DEFAULTS.items()}
+        Tw = float(body['Tw']) if body.get('Tw') is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error='A cost needs component1, component2, xF, xD, xB, R and q'), 400
+
+    error = vle.check_design(*design) or check_plant(plant)
+    if error:
+        return jsonify(error=error), 400
+
+    try:
+        cost = get_vle_cost(*component_ids, *design, plant, Tw)
+    except ValueError as cost_error:
+        return jsonify(error=str(cost_error)), 422
+    if cost is None:
+        return jsonify(error='There is no data for this combination of components'), 404
+
+    result, nstage, Tw, costs = cost
+    return jsonify(
+        nstage=result.nstage,
+        nstage_real=nstage,
+        feed_stage=result.feed_stage,
+        Tw=Tw,
+        plant=plant,
+        units='$/1000 lb distillate',
+        costs=costs._asdict()
+    )
+
+
+# -------------------------------------------------------------------------------------------------
+# Reflux ratio, alone or with the feed temperature, with the lowest break-even cost and the cost
+# against R for plotting
+# -------------------------------------------------------------------------------------------------
+@app.route('/api/v1/optimize/reflux', methods=['POST'])
+def api_optimize_reflux():
+    body = request.get_json(silent=True) or {}
+
+    try:
+        component_ids = [int(body['component1']), int(body['component2'])]
+        design = [float(body[name]) for name in ('xF', 'xD', 'xB', 'q')]
+        R_min, R_max = float(body['R_min']), float(body['R_max'])
+        points = int(body.get('points', 100))
+        tol = float(body.get('tol', 1e-4))
+        plant = {name: float(body.get(name, default)) for name, default in PLANT_DEFAULTS.items()}
+        Tw = float(body['Tw']) if body.get('Tw') is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error='An optimization needs component1, component2, xF, xD, xB, q, R_min and R_max'), 400
+
+    xF, xD, xB, q = design
+    error = vle.check_design(xF, xD, xB, R_min, q) or check_plant(plant)
+    if not error and not R_min < R_max:
+        error = 'Reflux ratios must satisfy 0 < R_min < R_max'
+    if not error and not 2 <= points <= app.config['API_MAX_CASES']:
+        error = 'points must be between 2 and {}'.format(app.config['API_MAX_CASES'])
+    if not error and not tol > 0:
+        error = 'tol must be positive'
+    if error:
+        return jsonify(error=error), 400
+
+    try:
+        optimum = get_reflux_optimum(*component_ids, xF, xD, xB, q, plant, R_min, R_max, Tw, points, tol)
+    except ValueError as optimize_error:
+        return jsonify(error=str(optimize_error)), 422
+    if optimum is None:
+        return jsonify(error='There is no data for this combination of components'), 404
+
+    return jsonify(units='$/1000 lb distillate', plant=plant, **reflux_optimum_json(optimum, plant))
+
+
+@app.route('/api/v1/optimize/feed', methods=['POST'])
+def api_optimize_feed():
+    body = request.get_json(silent=True) or {}
+
+    try:
+        component_ids = [int(body['component1']), int(body['component2'])]
+        xF, xD, xB = [float(body[name]) for name in ('xF', 'xD', 'xB')]
+        R_min, R_max = float(body['R_min']), float(body['R_max'])
+        TF_min, TF_max = float(body['TF_min']), float(body['TF_max'])
+        TF_points = int(body.get('TF_points', 8))
+        TF_tol = float(body.get('TF_tol', 0.1))
+        points = int(body.get('points', 100))
+        tol = float(body.get('tol', 1e-4))
+        plant = {name: float(body.get(name, default)) for name, default in PLANT_DEFAULTS.items()}
+        Tw = float(body['Tw']) if body.get('Tw') is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error='An optimization needs component1, component2, xF, xD, xB, '
+                             'R_min, R_max, TF_min and TF_max'), 400
+
+    # q is highest at TF_min and lowest at TF_max, both ends must be valid.
+    # q divides by Hvap, so the plant is checked first
+    error = check_plant(dict(plant, TF=TF_max)) or \
+        vle.check_design(xF, xD, xB, R_min, feed_quality(TF_min, xF, plant)) or \
+        vle.check_design(xF, xD, xB, R_min, feed_quality(TF_max, xF, plant))
+    if not error and not R_min < R_max:
+        error = 'Reflux ratios must satisfy 0 < R_min < R_max'
+    if not error and not TF_min < TF_max:
+        error = 'Feed temperatures must satisfy TF_min < TF_max'
+    if not error and TF_min <= plant['TB'] <= TF_max:
+        error = 'Feed temperatures must not include the {:.1f} F bubble point TB, where q is 1'.format(plant['TB'])
+    if not error and not 2 <= TF_points <= 64:
+        error = 'TF_points must be between 2 and 64'
+    if not error and not 2 <= points <= app.config['API_MAX_CASES']:
+        error = 'points must be between 2 and {}'.format(app.config['API_MAX_CASES'])
+    if not error and not (tol > 0 and TF_tol > 0):
+        error = 'tol and TF_tol must be positive'
+    if error:
+        return jsonify(error=error), 400
+
+    try:
+        optimum = get_feed_optimum(*component_ids, xF, xD, xB, plant, R_min, R_max, TF_min, TF_max,
+                                   Tw, TF_points, points, tol, TF_tol)
+    except ValueError as optimize_error:
+        return jsonify(error=str(optimize_error)), 422
+    if optimum is None:
+        return jsonify(error='There is no data for this combination of components'), 404
+
+    reflux = reflux_optimum_json(optimum.reflux, plant)
+    reflux['optimum'].update(TF=optimum.TF, q=optimum.q)
+
+    return jsonify(
+        feeds=[{'TF': TF, 'q': q, 'R': R, 'nstage': nstage, 'total': total}
+               for TF, q, R, nstage, total in optimum.feeds],
+        steppings=optimum.steppings,
+        units='$/1000 lb distillate',
+        plant=dict(plant, TF=optimum.TF),
+        **reflux
+    )
+
+
+def reflux_optimum_json(optimum, plant):
+    """
+    JSON form of a RefluxOptimum
+    """
+    return {
+        'optimum': {
+            'R': optimum.R,
+            'nstage': optimum.nstage,
+            'nstage_real': vle.calc_nstages(optimum.nstage, plant['efficiency']),
+            'Tw': optimum.Tw,
+            'costs': optimum.costs._asdict()
+        },
+        'breakpoints': [{'R_below': R_below, 'R_above': R_above,
+                         'nstage_below': finite_or_none(nstage_below, int),
+                         'nstage_above': finite_or_none(nstage_above, int)}
+                        for R_below, R_above, nstage_below, nstage_above in optimum.breakpoints],
+        'curve': {name: [finite_or_none(value, int if name == 'nstage' else float) for value in values]
+                  for name, values in optimum.curve.items()},
+        'evaluations': optimum.evaluations
+    }
+
+
+def finite_or_none(value, convert=float):
+    """
+    Number for JSON converted with convert, None if it is nan or infinite
+    """
+    value = float(value)
+
+    return convert(value) if math.isfinite(value) else None
+
+
+# -------------------------------------------------------------------------------------------------
+# Background jobs for long calculations such as reflux sweeps
+# -------------------------------------------------------------------------------------------------
+def job_user_id():
+    """
+    Id of the signed in user that owns the jobs of this request, None if
+    nobody is signed in
+    """
+    return current_user.id if current_user.is_authenticated else None
+
+
+@app.route('/api/v1/jobs', methods=['POST'])
+def api_submit_job():
+    body = request.get_json(silent=True) or {}
+    params, error = parse_job_params(body.get('kind'), body.get('params') or {})
+    if error:
+        return jsonify(error=error), 400
+
+    job_id = submit_job(body['kind'], params, job_user_id())
+
+    response = jsonify(id=job_id, status='queued')
+    response.status_code = 202
+    response.headers['Location'] = url_for('api_job', job_id=job_id)
+    return response
+
+
+@app.route('/api/v1/jobs/<job_id>', methods=['GET', 'DELETE'])
+def api_job(job_id):
+    # Jobs of other users are not found
+    if request.method == 'DELETE':
+        job = cancel_job(job_id, job_user_id())
+    else:
+        job = get_job(job_id, job_user_id())
+    if job is None:
+        abort(404)
+
+    return jsonify(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        progress=job.progress,
+        error=job.error,
+        created_at=job.created_at.isoformat() + 'Z',
+        finished_at=job.finished_at.isoformat() + 'Z' if job.finished_at else None
+    )
+
+
+@app.route('/api/v1/jobs/<job_id>/result')
+def api_job_result(job_id):
+    job = get_job(job_id, job_user_id())
+    if job is None:
+        abort(404)
+    if job.status != 'done':
+        return jsonify(error='Job is {}'.format(job.status), status=job.status), 409
+    if job_expired(job):
+        return jsonify(error='The result of this job has expired'), 410
+
+    return Response(job.result, mimetype='application/json')
+
+
+# -------------------------------------------------------------------------------------------------
+# Graph image for a design, cacheable by browsers and proxies
+# -------------------------------------------------------------------------------------------------
+GRAPH_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+@app.route('/graph.<fmt>')
+def graph(fmt):
+    if fmt not in GRAPH_MIMETYPES:
+        abort(404)
+
+    try:
+        component1_id = int(request.args['component1'])
+        component2_id = int(request.args['component2'])
+        design = [float(request.args[name]) for name in ('xF', 'xD', 'xB', 'R', 'q')]
+    except (KeyError, ValueError):
+        abort(400)
+
+    design_error = vle.check_design(*design)
+    if design_error:
+        abort(400, description=design_error)
+
+    # Answer revalidations without rendering anything
+    etag = get_graph_key(component1_id, component2_id, *design, fmt=fmt)
+    if etag is None:
+        abort(404)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+
+    else:
+        vle_plot, nstage = get_vle_graph(component1_id, component2_id, *design, fmt=fmt)
+        if vle_plot is None:
+            abort(422)
+        response = Response(vle_plot, mimetype=GRAPH_MIMETYPES[fmt])
+
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['GRAPH_MAX_AGE']
+
+    return response
+
+
+# -------------------------------------------------------------------------------------------------
+# Cache statistics, used to size the caches
+# -------------------------------------------------------------------------------------------------
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(curve_cache=curve_cache.stats(), graph_cache=graph_cache.stats(),
+                   component_cache=component_cache.stats(), stage_cache=stage_cache.stats(),
+                   temperature_cache=temperature_cache.stats(), reflux_cache=reflux_cache.stats())
 
 
 # -------------------------------------------------------------------------------------------------
@@ -169,9 +617,33 @@ def logout():
 @app.route('/upload', methods=['GET', 'POST'])
 def upload():
     if request.method == 'POST':
+        user_file = request.files.get('user-file')
+        has_file = user_file is not None and user_file.filename != ''
+
+        # Optional analytic model, fitted to the file or given by its parameters
+        model = request.form.get('model') or None
+        if model is not None and model not in ANALYTIC_MODELS:
+            flash('Unknown equilibrium model')
+            return render_template('upload.html')
+
+        params = None
+        if model is not None and not has_file:
+            try:
+                params = {name: float(request.form[name]) for name in ANALYTIC_MODELS[model]}
+            except (KeyError, ValueError):
+                flash('Enter {} for this model, or upload data to fit them'.format(
+                    ', '.join(ANALYTIC_MODELS[model])))
+                return render_template('upload.html')
+
+            # Building the curve checks the parameters
+            try:
+                analytic_curve(model, params)
+            except ValueError as error:
+                flash(str(error))
+                return render_template('upload.html')
 
         # Attempt to get files from user
-        if request.files['user-file'].filename != '':
+        if has_file or params is not None:
             component1 = request.form['component1']
             component2 = request.form['component2']
             
@@ -188,37 +660,34 @@ def upload():
             if Component.query.filter_by(name=component2).count() == 0:
                 upload_component(component2)          
 
-            # Get and convert data to database-ready format
-            data = pd.read_csv(request.files.get('user-file')) 
-            # Add a new column to the data that has the two columns joined
-            # so they can be uploaded to the database
-            data = np.trunc(1000 * data) / 1000 # Truncate floating points
-            
-            # Create new column of strings
-            data['points'] = data[data.columns[0:]].apply(
-                lambda x: ','.join(x.dropna().astype(str)),
-                axis=1
-            ) 
-
             # Get component ids
             component1_id = Component.query.filter_by(name=component1).first().id
             component2_id = Component.query.filter_by(name=component2).first().id
 
             # Check that data for this combo of components does not exist
-            if (VleData.query.filter_by(component1_id=component1_id).\
-                filter_by(component2_id=component2_id).first()):
+            if dataset_exists(component1_id, component2_id):
                 flash('Data for this combination of components already exists')
                 return render_template('upload.html')
 
-            # Check that data for this combo of components does not exist
-            if (VleData.query.filter_by(component1_id=component2_id).\
-                filter_by(component1_id=component2_id).first()):
+            # A model given by its parameters has no data to upload
+            if not has_file:
+                uploaded = upload_vle_model(component1_id, component2_id, current_user.get_id(),
+                                            model, params)
+            else:
+                # Get and convert data to database-ready format, pandas is only
+                # imported by the workers that handle uploads
+                import numpy as np
+                import pandas as pd
+                data = pd.read_csv(user_file) 
+                data = np.trunc(1000 * data) / 1000 # Truncate floating points
+
+                # Perform query to insert data to postgresql
+                uploaded = upload_vle(data, component1_id, component2_id, current_user.get_id(), model)
+
+            if uploaded is None:
                 flash('Data for this combination of components already exists')
                 return render_template('upload.html')
 
-            # Perform query to insert data to postgresql
-            upload_vle(data, component1_id, component2_id, current_user.get_id())
-
             flash("Data successfully uploaded!")
             return redirect(url_for('upload'))
 
@@ -231,23 +700,31 @@ def upload():
 # -------------------------------------------------------------------------------------------------
 @app.route('/profile', methods=['GET', 'POST'])
 def profile():
-    user_vle = get_user_vle_dict(current_user.get_id()) 
+    # Only a logged in user has data to list or delete
+    if not current_user.is_authenticated:
+        return redirect(url_for('login'))
+
+    user_id = int(current_user.get_id())
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['PROFILE_PAGE_SIZE']
+    user_vle, total = get_user_datasets(user_id, page, per_page)
+    pages = max((total + per_page - 1) // per_page, 1)
 
     if request.method == 'POST':
         # Get form data
         try: 
             component_ids = request.form['uploaded-data']
+            # Transform data into integers that are component ids
+            component1_id, component2_id = [int(i) for i in component_ids.split(',')]
         except:
             flash("Please select your components")
-            return render_template('profile.html', user_vle=user_vle)
+            return render_template('profile.html', user_vle=user_vle, page=page, pages=pages)
 
-        # Transform data into integers that are component ids
-        component1_id, component2_id = int(component_ids[1]), int(component_ids[4])
-        delete_user_data(component1_id, component2_id, current_user.get_id())
+        delete_user_data(component1_id, component2_id, user_id)
 
-        return redirect(url_for('profile'))
+        return redirect(url_for('profile', page=page))
 
-    return render_template('profile.html', user_vle=user_vle)
+    return render_template('profile.html', user_vle=user_vle, page=page, pages=pages)
 
 
 
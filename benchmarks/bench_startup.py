@@ -0,0 +1,99 @@
+# ***************************************************************************
+# * Distillation Column Calculation - bench_startup.py
+# * Spencer Wagner
+# *
+# * Measures the cold start of a worker: importing the app, the warm-up and
+# * the first graph requests, each in a fresh interpreter
+# * Run from the repository root: python benchmarks/bench_startup.py
+# ***************************************************************************
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the fresh interpreter, prints the time of each step in seconds
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+if sys.argv[1] == '1':
+	from static.py.VLE_graph import warm_up
+	warm_up()
+warmed = time.perf_counter()
+client = app.test_client()
+times = []
+for R in (2.0, 3.0):
+	begin = time.perf_counter()
+	response = client.get('/graph.png?component1=1&component2=2&xF=0.3&xD=0.8&xB=0.05&q=0.5&R={}'.format(R))
+	assert response.status_code == 200, response.status_code
+	times.append(time.perf_counter() - begin)
+print(json.dumps({'import': imported - start, 'warm_up': warmed - imported,
+	'first_graph': times[0], 'second_graph': times[1],
+	'modules': len(sys.modules)}))
+'''
+
+
+def seed_database(path):
+	"""
+	Creates a sqlite database at path holding the bundled ethanol-water data
+	"""
+	import pandas as pd
+
+	from app import app
+	from database.extensions import db
+	from database.commands import upload_component, upload_vle
+
+	with app.app_context():
+		db.create_all()
+		upload_component('ethanol')
+		upload_component('water')
+		upload_vle(pd.read_csv(os.path.join(ROOT, 'static', 'files', 'ethanol-water.csv')), 1, 2, None)
+
+
+def cold_start(env, warm_up):
+	"""
+	Starts a fresh interpreter, returns the times it reported and the wall
+	time of the whole process
+	"""
+	begin = time.perf_counter()
+	output = subprocess.run(
+		[sys.executable, '-c', CHILD, '1' if warm_up else '0'],
+		cwd=ROOT, env=env, check=True, capture_output=True, text=True
+	).stdout
+	times = json.loads(output.strip().splitlines()[-1])
+	times['process'] = time.perf_counter() - begin
+
+	return times
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Measures the cold start of a worker')
+	parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per scenario')
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		database = 'sqlite:///' + os.path.join(directory, 'bench.db')
+		os.environ['DATABASE_URL'] = database
+		sys.path.insert(0, ROOT)
+		seed_database(database)
+
+		env = dict(os.environ, DATABASE_URL=database, SECRET_KEY='bench', SERVER_TIMING='0')
+
+		print('{:<10} {:>10} {:>10} {:>12} {:>12} {:>10} {:>8}'.format(
+			'warm-up', 'import ms', 'warm ms', '1st graph ms', '2nd graph ms', 'process ms', 'modules'))
+		for warm_up in (False, True):
+			runs = [cold_start(env, warm_up) for _ in range(args.runs)]
+			median = {field: float(np.median([run[field] for run in runs]))
+				for field in ('import', 'warm_up', 'first_graph', 'second_graph', 'process', 'modules')}
+			print('{:<10} {:>10.1f} {:>10.1f} {:>12.1f} {:>12.1f} {:>10.1f} {:>8.0f}'.format(
+				'yes' if warm_up else 'no', median['import'] * 1000, median['warm_up'] * 1000,
+				median['first_graph'] * 1000, median['second_graph'] * 1000,
+				median['process'] * 1000, median['modules']))
@@ -0,0 +1,307 @@
+# ***************************************************************************
+# * Distillation Column Calculation - bench_suite.py
+# * Spencer Wagner
+# *
+# * Times the calculation and data paths on the bundled datasets and on
+# * synthetic datasets of 20 to 100k points, reporting latency percentiles
+# * and peak memory. Results can be saved as a JSON baseline and later runs
+# * compared against it, failing on regressions beyond a threshold
+# *
+# * Run from the repository root:
+# *   python benchmarks/bench_suite.py --save       record the baseline
+# *   python benchmarks/bench_suite.py              compare against it
+# ***************************************************************************
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# upload_vle drops every table before each run, so the suite always uses a
+# private in-memory database, never the DATABASE_URL of the environment
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import numpy as np
+import pandas as pd
+
+from app import app
+from database.commands import upload_vle, point_to_dataframe
+import static.py.VLE_graph as vle
+from static.py.heat_duty import PLANT_DEFAULTS
+from static.py.optimize import optimize_reflux
+from bench_upload import synthetic_vle, reset_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# Design every benchmark is run with
+DESIGN = {'xF': 0.3, 'xD': 0.8, 'xB': 0.05, 'R': 3.0, 'q': 0.5}
+
+# Reflux ratio below the minimum of DESIGN on every dataset
+PINCH_R = 0.1
+
+SYNTHETIC_SIZES = (20, 1000, 10000, 100000)
+
+# Stand-in for a VleData row with the old "x,y,T" point column
+LegacyPoint = namedtuple('LegacyPoint', ['point'])
+
+
+###############################################################################
+# DATASETS
+###############################################################################
+def bundled_datasets():
+	"""
+	The datasets in static/files keyed by file name
+	"""
+	datasets = {}
+	for path in sorted(glob.glob(os.path.join(ROOT, 'static', 'files', '*.csv'))):
+		datasets[os.path.basename(path)[:-4]] = pd.read_csv(path)
+
+	return datasets
+
+
+def synthetic_datasets(sizes):
+	"""
+	Constant relative volatility datasets keyed by their number of points
+	"""
+	return {'synthetic-{}'.format(size): synthetic_vle(size) for size in sizes}
+
+
+###############################################################################
+# MEASUREMENT
+###############################################################################
+def measure(func, setup=None, repeat=20, budget=2.0):
+	"""
+	Calls func repeat times, or fewer once budget seconds are used, and
+	returns the latencies in seconds, the peak memory in bytes of one extra
+	traced call and the value func returned. setup() is called untimed
+	before each call
+	"""
+	# Warm up caches and lazy imports before timing
+	if setup is not None:
+		setup()
+	func()
+
+	times = []
+	start = time.perf_counter()
+	while len(times) < repeat and (len(times) < 3 or time.perf_counter() - start < budget):
+		if setup is not None:
+			setup()
+		begin = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - begin)
+
+	if setup is not None:
+		setup()
+	tracemalloc.start()
+	value = func()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return times, peak, value
+
+
+def summarize(times, peak, value=None):
+	"""
+	Latency percentiles in milliseconds and peak memory in KiB
+	"""
+	times = np.array(times) * 1000
+	summary = {
+		'runs': len(times),
+		'p50_ms': float(np.percentile(times, 50)),
+		'p95_ms': float(np.percentile(times, 95)),
+		'p99_ms': float(np.percentile(times, 99)),
+		'max_ms': float(times.max()),
+		'peak_kib': peak / 1024
+	}
+	if value is not None:
+		summary['result'] = value
+
+	return summary
+
+
+###############################################################################
+# BENCHMARKS
+###############################################################################
+# Each benchmark takes a dataset and returns (func, setup). func returns a
+# value to check against the baseline, or None
+def bench_get_data(vle_data):
+	def run():
+		vle.get_data(vle_data)
+
+	return run, None
+
+
+def bench_distillation_stages(vle_data):
+	x_sep, y_sep = vle.get_data(vle_data)
+	q_line = vle.solve_q(DESIGN['q'], DESIGN['xF'])[2]
+	enr_line, strip_line = vle.solve_enriching_stripping(DESIGN['R'], q_line, DESIGN['xD'], DESIGN['xB'])[:2]
+	fig = vle.new_figure()
+	ax = fig.add_subplot()
+
+	def run():
+		ax.clear()
+		return vle.distillation_stages(ax, x_sep, y_sep, DESIGN['xB'], DESIGN['xD'], enr_line, strip_line)
+
+	return run, None
+
+
+def bench_do_graph(vle_data):
+	return (lambda: vle.do_graph(vle_data, **DESIGN)[1]), None
+
+
+def bench_serve_graph(vle_data):
+	fig = vle.draw_graph(vle_data, **DESIGN)[0]
+	if fig is None:
+		return None, None
+
+	def run():
+		vle.serve_graph(fig)
+
+	return run, None
+
+
+def bench_point_to_dataframe(vle_data):
+	rows = [LegacyPoint(','.join(str(value) for value in point)) for point in vle_data.itertuples(index=False)]
+
+	return (lambda: len(point_to_dataframe(rows))), None
+
+
+def bench_upload_vle(vle_data):
+	return (lambda: upload_vle(vle_data, 1, 2, None)[0]), reset_database
+
+
+def bench_optimize_reflux(vle_data):
+	curve = vle.fit_curve(vle_data)
+
+	def step(R):
+		return vle.calc_stages(curve, DESIGN['xF'], DESIGN['xD'], DESIGN['xB'], R, DESIGN['q'])
+
+	# Bottom stage temperature fixed at 370 K, the number of reflux ratios
+	# stepped off is checked against the baseline
+	def run():
+		return optimize_reflux(step, lambda x: 370.0, DESIGN['xF'], DESIGN['xD'], DESIGN['xB'],
+			DESIGN['q'], PLANT_DEFAULTS, 0.5, 10).evaluations
+
+	return run, None
+
+
+def bench_pinch(vle_data):
+	curve = vle.fit_curve(vle_data)
+	design = dict(DESIGN, R=PINCH_R)
+
+	# Rejected by the pinch check, the stage count is checked against the
+	# baseline
+	return (lambda: vle.calc_stages(curve, **design).nstage), None
+
+
+BENCHMARKS = {
+	'get_data': bench_get_data,
+	'distillation_stages': bench_distillation_stages,
+	'do_graph': bench_do_graph,
+	'serve_graph': bench_serve_graph,
+	'point_to_dataframe': bench_point_to_dataframe,
+	'upload_vle': bench_upload_vle,
+	'optimize_reflux': bench_optimize_reflux,
+	'pinch': bench_pinch
+}
+
+
+def run_suite(datasets, names, repeat, budget):
+	"""
+	Runs the named benchmarks on every dataset, printing each summary.
+	Returns the summaries keyed by "benchmark/dataset"
+	"""
+	results = {}
+	print('{:<48} {:>5} {:>10} {:>10} {:>10} {:>11}'.format(
+		'benchmark', 'runs', 'p50 ms', 'p95 ms', 'p99 ms', 'peak KiB'))
+
+	for name in names:
+		for dataset, vle_data in datasets.items():
+			func, setup = BENCHMARKS[name](vle_data)
+			if func is None:
+				continue
+
+			key = '{}/{}'.format(name, dataset)
+			results[key] = summarize(*measure(func, setup, repeat, budget))
+			summary = results[key]
+			print('{:<48} {:>5} {:>10.3f} {:>10.3f} {:>10.3f} {:>11.1f}'.format(
+				key, summary['runs'], summary['p50_ms'], summary['p95_ms'],
+				summary['p99_ms'], summary['peak_kib']))
+
+	return results
+
+
+###############################################################################
+# BASELINE
+###############################################################################
+def compare(results, baseline, threshold):
+	"""
+	Returns a message for every benchmark whose median latency or peak
+	memory grew by more than threshold over the baseline, or whose result
+	changed
+	"""
+	regressions = []
+	for key, summary in results.items():
+		if key not in baseline:
+			continue
+		before = baseline[key]
+
+		for field in ('p50_ms', 'peak_kib'):
+			if before[field] > 0 and summary[field] > before[field] * (1 + threshold):
+				regressions.append('{} {}: {:.3f} -> {:.3f} (+{:.0%})'.format(
+					key, field, before[field], summary[field], summary[field] / before[field] - 1))
+
+		if before.get('result') != summary.get('result'):
+			regressions.append('{} result: {} -> {}'.format(key, before.get('result'), summary.get('result')))
+
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Times the calculation and data paths')
+	parser.add_argument('--baseline', default=BASELINE, help='baseline JSON file')
+	parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+	parser.add_argument('--threshold', type=float, default=0.25,
+		help='fractional growth of p50 latency or peak memory counted as a regression')
+	parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS),
+		help='benchmarks to run')
+	parser.add_argument('--sizes', nargs='+', type=int, default=list(SYNTHETIC_SIZES),
+		help='synthetic dataset sizes')
+	parser.add_argument('--repeat', type=int, default=20, help='most timed runs per benchmark')
+	parser.add_argument('--budget', type=float, default=2.0, help='seconds per benchmark')
+	args = parser.parse_args()
+
+	datasets = bundled_datasets()
+	datasets.update(synthetic_datasets(args.sizes))
+
+	with app.app_context():
+		results = run_suite(datasets, args.only, args.repeat, args.budget)
+
+	if args.save:
+		with open(args.baseline, 'w') as baseline_file:
+			json.dump(results, baseline_file, indent=1, sort_keys=True)
+		print('Saved baseline to {}'.format(args.baseline))
+		return 0
+
+	if not os.path.exists(args.baseline):
+		print('No baseline at {}, run with --save to record one'.format(args.baseline))
+		return 0
+
+	with open(args.baseline) as baseline_file:
+		regressions = compare(results, json.load(baseline_file), args.threshold)
+
+	for regression in regressions:
+		print('REGRESSION ' + regression)
+	print('{} regressions against {}'.format(len(regressions), args.baseline))
+
+	return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,97 @@
+# ***************************************************************************
+# * Distillation Column Calculation - bench_upload.py
+# * Spencer Wagner
+# *
+# * Compares the bulk VLE upload against the old per-row ORM upload
+# * Run from the repository root: python benchmarks/bench_upload.py
+# ***************************************************************************
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Private in-memory database the benchmarks drop and recreate. It replaces
+# any DATABASE_URL in the environment, which may point at real data
+DATABASE_URL = 'sqlite://'
+os.environ['DATABASE_URL'] = DATABASE_URL
+
+import numpy as np
+import pandas as pd
+
+from app import app
+from database.extensions import db
+from database.models import Component, VleData
+from database.commands import upload_vle
+
+
+def synthetic_vle(npoints):
+	"""
+	Returns a dataset of npoints with constant relative volatility
+	"""
+	x = np.linspace(0, 1, npoints)
+	y = 2.5 * x / (1 + 1.5 * x)
+	T = 373.15 - 20 * x
+
+	return pd.DataFrame({'x1': x, 'y1': y, 'T': T})
+
+
+def legacy_upload(vle_data, component1_id, component2_id, user_id):
+	"""
+	The previous upload path: a row-wise string column and one ORM object
+	per point
+	"""
+	vle_data = vle_data.copy()
+	vle_data['points'] = vle_data[vle_data.columns[0:]].apply(
+		lambda x: ','.join(x.dropna().astype(str)),
+		axis=1
+	)
+
+	for val in vle_data['points']:
+		db.session.add(VleData(
+			component1_id=component1_id,
+			component2_id=component2_id,
+			point=val,
+			user_id=user_id
+		))
+	db.session.commit()
+
+
+def reset_database():
+	"""
+	Drops and recreates every table with components 1 and 2. Refuses to
+	touch any database but DATABASE_URL
+	"""
+	for url in (app.config['SQLALCHEMY_DATABASE_URI'], str(db.engine.url)):
+		if url != DATABASE_URL:
+			raise RuntimeError('Refusing to drop the tables of {}, benchmarks only use {}'.format(url, DATABASE_URL))
+
+	db.session.rollback()
+	db.drop_all()
+	db.create_all()
+	db.session.add_all([Component(name='A'), Component(name='B')])
+	db.session.commit()
+
+
+def time_upload(upload, vle_data):
+	"""
+	Uploads vle_data to an empty database, returns the rows per second
+	"""
+	reset_database()
+
+	start = time.perf_counter()
+	upload(vle_data, 1, 2, None)
+	elapsed = time.perf_counter() - start
+
+	assert VleData.query.count() == len(vle_data)
+	return len(vle_data) / elapsed
+
+
+if __name__ == '__main__':
+	with app.app_context():
+		print('{:>8} {:>16} {:>16} {:>8}'.format('points', 'legacy rows/s', 'bulk rows/s', 'speedup'))
+		for npoints in (20, 1000, 5000, 20000):
+			vle_data = synthetic_vle(npoints)
+			legacy = time_upload(legacy_upload, vle_data)
+			bulk = time_upload(upload_vle, vle_data)
+			print('{:>8} {:>16.0f} {:>16.0f} {:>7.1f}x'.format(npoints, legacy, bulk, bulk / legacy))
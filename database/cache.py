@@ -0,0 +1,368 @@
+# ***************************************************************************
+# * Distillation Column Calculation - cache.py
+# * Spencer Wagner
+# *
+# * Caches for data that is expensive to rebuild on every request
+# ***************************************************************************
+from collections import OrderedDict
+from threading import Lock, get_ident
+import hashlib
+import os
+import time
+
+
+class LRUCache:
+	"""
+	Bounded least-recently-used cache that is safe to share between the
+	threads of a worker. Counts hits and misses so the size can be tuned.
+	sizeof gives the weight of a value against maxsize, every value weighs
+	1 by default
+	"""
+	def __init__(self, maxsize=128, sizeof=None):
+		self.maxsize = maxsize
+		self.sizeof = sizeof or (lambda value: 1)
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self._data = OrderedDict()
+		self._lock = Lock()
+
+	def get(self, key, default=None):
+		"""
+		Returns the value cached for key, marking it as recently used
+		"""
+		with self._lock:
+			if key in self._data:
+				self._data.move_to_end(key)
+				self.hits += 1
+				return self._data[key]
+
+			self.misses += 1
+			return default
+
+	def set(self, key, value):
+		"""
+		Caches value for key, evicting the least recently used entries
+		"""
+		with self._lock:
+			if key in self._data:
+				self.size -= self.sizeof(self._data.pop(key))
+
+			self._data[key] = value
+			self.size += self.sizeof(value)
+
+			while self.size > self.maxsize and self._data:
+				self.size -= self.sizeof(self._data.popitem(last=False)[1])
+
+	def invalidate(self, match):
+		"""
+		Removes every entry whose key match(key) is true for
+		"""
+		with self._lock:
+			for key in [key for key in self._data if match(key)]:
+				self.size -= self.sizeof(self._data.pop(key))
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+			self.size = 0
+
+	def stats(self):
+		"""
+		Returns the hit/miss counters and the current size
+		"""
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit_ratio': self.hits / lookups if lookups else 0.0,
+				'entries': len(self._data),
+				'size': self.size,
+				'maxsize': self.maxsize
+			}
+
+
+class VersionedValue:
+	"""
+	A single cached value that is rebuilt after its version is bumped. Other
+	workers cannot bump it, so it is also rebuilt once it is max_age seconds
+	old, which bounds how long their changes go unseen
+	"""
+	def __init__(self, max_age=None):
+		self.max_age = max_age
+		self.version = 0
+		self.hits = 0
+		self.misses = 0
+		self._value = None
+		self._loaded = None
+		self._lock = Lock()
+
+	def get(self, load):
+		"""
+		Returns the cached value, calling load() to rebuild it when stale
+		"""
+		with self._lock:
+			version, loaded = self.version, self._loaded
+			fresh = loaded is not None and loaded[0] == version and \
+				(self.max_age is None or time.monotonic() - loaded[1] < self.max_age)
+
+			if fresh:
+				self.hits += 1
+				return self._value
+			self.misses += 1
+
+		value = load()
+		with self._lock:
+			# Don't overwrite a value loaded after a newer bump
+			if self.version == version:
+				self._value = value
+				self._loaded = (version, time.monotonic())
+
+		return value
+
+	def bump(self):
+		"""
+		Marks the cached value as stale
+		"""
+		with self._lock:
+			self.version += 1
+
+	def stats(self):
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit_ratio': self.hits / lookups if lookups else 0.0,
+				'version': self.version
+			}
+
+
+###############################################################################
+# RENDERED GRAPH STORES
+###############################################################################
+# Rendered graphs are stored as bytes under a content-addressed key, any of
+# these stores can hold them
+class MemoryStore:
+	"""
+	Keeps rendered graphs in this process, bounded by their total bytes
+	"""
+	def __init__(self, max_bytes):
+		self._cache = LRUCache(max_bytes, sizeof=len)
+
+	def get(self, key):
+		return self._cache.get(key)
+
+	def set(self, key, value):
+		self._cache.set(key, value)
+
+	def stats(self):
+		return self._cache.stats()
+
+
+class FileStore:
+	"""
+	Keeps rendered graphs as files in a directory shared by every worker on
+	the machine. Reading a file touches it, so the least recently used files
+	are removed first once the directory holds more than max_bytes. The size
+	is kept as a running total, the directory is only listed when the total
+	goes over max_bytes, which also counts the files of the other workers
+	"""
+	# Eviction goes down to this fraction of max_bytes, so a full store isn't
+	# listed again on the next set
+	EVICT_TO = 0.9
+
+	def __init__(self, directory, max_bytes):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self._lock = Lock()
+		os.makedirs(directory, exist_ok=True)
+
+		self.size = sum(size for _, size, _ in self._files())
+
+	def _path(self, key):
+		return os.path.join(self.directory, key)
+
+	def get(self, key):
+		try:
+			with open(self._path(key), 'rb') as cached:
+				value = cached.read()
+			os.utime(self._path(key))
+		except OSError:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		return value
+
+	def set(self, key, value):
+		try:
+			replaced = os.stat(self._path(key)).st_size
+		except OSError:
+			replaced = 0
+
+		# Write to a temporary file first so readers never see half a file
+		temp_path = self._path('{}.{}.{}.tmp'.format(key, os.getpid(), get_ident()))
+		with open(temp_path, 'wb') as cached:
+			cached.write(value)
+		os.replace(temp_path, self._path(key))
+
+		with self._lock:
+			self.size += len(value) - replaced
+			if self.size > self.max_bytes:
+				self._evict()
+
+	def _files(self):
+		"""
+		Returns (mtime, size, path) of every stored file
+		"""
+		files = []
+		for entry in os.scandir(self.directory):
+			if entry.is_file() and not entry.name.endswith('.tmp'):
+				try:
+					stat = entry.stat()
+				except OSError:
+					continue
+				files.append((stat.st_mtime, stat.st_size, entry.path))
+
+		return files
+
+	def _evict(self):
+		"""
+		Removes the least recently used files until the store fits EVICT_TO
+		of max_bytes, and resets the running size from the directory
+		"""
+		files = self._files()
+
+		total = sum(size for _, size, _ in files)
+		for _, size, path in sorted(files):
+			if total <= self.max_bytes * self.EVICT_TO:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			total -= size
+
+		self.size = total
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_ratio': self.hits / lookups if lookups else 0.0,
+			'size': self.size,
+			'maxsize': self.max_bytes
+		}
+
+
+class RedisStore:
+	"""
+	Keeps rendered graphs in a Redis-protocol server shared by every worker.
+	Any client with get(key) and set(key, value, ex=seconds) works, which
+	lets a local stand-in replace the server. Size is bounded by the
+	server's own maxmemory eviction policy, entries also expire after ttl
+	"""
+	def __init__(self, url=None, client=None, ttl=24 * 60 * 60, prefix='vle-graph:'):
+		if client is None:
+			try:
+				import redis
+			except ImportError:
+				raise RuntimeError('The redis package is needed to cache graphs in Redis')
+			client = redis.Redis.from_url(url)
+
+		self.client = client
+		self.ttl = ttl
+		self.prefix = prefix
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		value = self.client.get(self.prefix + key)
+
+		if value is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+
+		return value
+
+	def set(self, key, value):
+		self.client.set(self.prefix + key, value, ex=self.ttl)
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_ratio': self.hits / lookups if lookups else 0.0
+		}
+
+
+def make_graph_store(kind, max_bytes, directory=None, url=None):
+	"""
+	Creates the store for rendered graphs: memory, filesystem or redis
+	"""
+	if kind == 'filesystem':
+		return FileStore(directory, max_bytes)
+	if kind == 'redis':
+		return RedisStore(url)
+
+	return MemoryStore(max_bytes)
+
+
+def graph_key(*inputs):
+	"""
+	Content-addressed key of a rendered graph: a hash of every input that
+	changes the image, including the dataset version
+	"""
+	return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+
+def pack_graph(image, nstage):
+	"""
+	Stores the number of stages ahead of the image bytes
+	"""
+	return str(nstage).encode() + b'\n' + image
+
+
+def unpack_graph(value):
+	"""
+	Returns the image bytes and number of stages stored by pack_graph
+	"""
+	nstage, image = value.split(b'\n', 1)
+
+	return image, int(nstage)
+
+
+# Fitted equilibrium curves keyed by (component1_id, component2_id, version,
+# model)
+curve_cache = LRUCache(int(os.getenv('VLE_CURVE_CACHE_SIZE', 64)))
+
+# Stepping results keyed by (component1_id, component2_id, version, model,
+# max_stages, xF, xD, xB, R, q), reused by repeated cost queries
+stage_cache = LRUCache(int(os.getenv('STAGE_CACHE_SIZE', 4096)))
+
+# Temperature profile of each dataset keyed by (component1_id,
+# component2_id, version)
+temperature_cache = LRUCache(int(os.getenv('VLE_TEMPERATURE_CACHE_SIZE', 64)))
+
+# Stepping results along a q-line keyed by (component1_id, component2_id,
+# version, model, max_stages, xF, xD, xB, q), each a dict of StageResult by R shared by
+# the reflux optimizations of every feed temperature with that q
+reflux_cache = LRUCache(int(os.getenv('REFLUX_CACHE_SIZE', 256)))
+
+# Component list and its search index, bumped when the component table changes
+component_cache = VersionedValue(int(os.getenv('COMPONENT_CACHE_MAX_AGE', 60)))
+
+# Rendered graphs keyed by graph_key
+graph_cache = make_graph_store(
+	os.getenv('GRAPH_CACHE', 'memory'),
+	int(os.getenv('GRAPH_CACHE_BYTES', 64 * 1024 * 1024)),
+	directory=os.getenv('GRAPH_CACHE_DIR', os.path.join('instance', 'graph_cache')),
+	url=os.getenv('GRAPH_CACHE_URL')
+)
@@ -6,12 +6,28 @@
 # ***************************************************************************
 from multiprocessing import synchronize
 import click
-import pandas as pd
+import io
+import json
+import math
+import time
+import numpy as np
+from flask import current_app
 from flask.cli import with_appcontext
 from copy import deepcopy
+from sqlalchemy import inspect, text, or_
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
 
-from .models import User, Component, VleData
+from .models import User, Component, VleData, VleDataset
 from .extensions import db
+from .cache import curve_cache, graph_cache, graph_key, pack_graph, unpack_graph
+from .cache import component_cache, stage_cache, temperature_cache, reflux_cache
+from .search import ComponentIndex
+from .metrics import span
+import static.py.VLE_graph as vle
+import static.py.VLE_models as models
+import static.py.optimize as optimize
+from static.py.pool import get_pool, pool_size, chunk
 
 
 @click.command(name='create_tables')
@@ -20,6 +36,72 @@ def drop_and_create_tables():
 	db.drop_all()
 	db.create_all()
 
+
+@click.command(name='migrate_points')
+@with_appcontext
+def migrate_points():
+	"""
+	Adds the numeric x, y and T columns to an existing vle_data table and
+	fills them in from the "x,y" / "x,y,T" point strings
+	"""
+	# Add the columns the table was created without
+	columns = [column['name'] for column in inspect(db.engine).get_columns('vle_data')]
+	with db.engine.begin() as connection:
+		for name in ('x', 'y', 't'):
+			if name not in columns:
+				connection.execute(text('ALTER TABLE vle_data ADD COLUMN {} FLOAT'.format(name)))
+
+	# Parse every point that has not been migrated yet
+	rows = db.session.query(VleData.id, VleData.point).\
+		filter(VleData.x.is_(None)).filter(VleData.point.isnot(None)).all()
+
+	updates = []
+	for row_id, point in rows:
+		values = [float(value) for value in point.split(',')]
+		updates.append({
+			'id': row_id,
+			'x': values[0],
+			'y': values[1],
+			'T': values[2] if len(values) > 2 else None
+		})
+
+	db.session.bulk_update_mappings(VleData, updates)
+	db.session.commit()
+	click.echo('Migrated {} points'.format(len(updates)))
+
+@click.command(name='migrate_datasets')
+@with_appcontext
+def migrate_datasets():
+	"""
+	Creates the vle_dataset table and the vle_data indexes on an existing
+	database and registers a dataset for every component pair with data
+	"""
+	db.create_all()
+	for index in VleData.__table__.indexes:
+		index.create(db.engine, checkfirst=True)
+
+	# Add the model columns the table was created without
+	columns = [column['name'] for column in inspect(db.engine).get_columns('vle_dataset')]
+	with db.engine.begin() as connection:
+		for name, column_type in (('model', 'VARCHAR(20)'), ('params', 'TEXT')):
+			if name not in columns:
+				connection.execute(text('ALTER TABLE vle_dataset ADD COLUMN {} {}'.format(name, column_type)))
+
+	# Register the pairs that have data but no dataset yet
+	pairs = db.session.query(VleData.component1_id, VleData.component2_id,
+		db.func.min(VleData.user_id)).\
+		group_by(VleData.component1_id, VleData.component2_id).all()
+	existing = set(db.session.query(VleDataset.component1_id, VleDataset.component2_id).all())
+
+	datasets = [
+		VleDataset(component1_id=component1_id, component2_id=component2_id, user_id=user_id)
+		for component1_id, component2_id, user_id in pairs
+		if (component1_id, component2_id) not in existing
+	]
+	db.session.add_all(datasets)
+	db.session.commit()
+	click.echo('Registered {} datasets'.format(len(datasets)))
+
 ###############################################################################
 # CREATE COMMANDS
 ###############################################################################
@@ -33,48 +115,157 @@ def upload_component(component):
     # Commit new user to the database
 	db.session.add(component_upload)
 	db.session.commit()
+	component_cache.bump()
 
 
-def upload_vle(vle_data, component1_id, component2_id, user_id):
+def upload_vle(vle_data, component1_id, component2_id, user_id, model=None):
 	"""
- 	Upload the VLE data to the vle_data table
+ 	Upload the VLE data to the vle_data table in one bulk insert. vle_data
+ 	holds x, y and optionally T in its first columns. If model is one of
+ 	the analytic models its parameters are fitted to the data once and
+ 	stored with the dataset. Returns the number of rows inserted and the
+ 	rows per second, or None if the component combination already has a
+ 	dataset
  	"""
+	start = time.perf_counter()
+
 	# Swap component ids so the lower id is always component 1
-	if component2_id < component1_id:
-		temp1 = deepcopy(component1_id)
-		temp2 = deepcopy(component2_id)
-		component1_id = temp2
-		component2_id = temp1
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
 
-	# Upload each data point to the database
-	for key, val in vle_data['points'].iteritems():
-		# Associate a user id to the data if it exists
-		if user_id:
-			datum = VleData(
-				component1_id=component1_id,
-				component2_id=component2_id,
-				point=val,
-				user_id=user_id
-			)
-		else:
-			datum = VleData(
-				component1_id=component1_id,
-				component2_id=component2_id,
-				point=val
-			)
-		# Add individual datum
-		db.session.add(datum)
+	numeric = np.asarray(vle_data, dtype=float)[:, :3]
+	params = json.dumps(models.fit_analytic(model, numeric)) if model else None
+
+	# Register the dataset first, the unique constraint rejects duplicates
+	# even when two uploads of the same combination race each other
+	db.session.add(VleDataset(
+		component1_id=component1_id,
+		component2_id=component2_id,
+		user_id=int(user_id) if user_id else None,
+		model=model,
+		params=params
+	))
+	try:
+		db.session.flush()
+	except IntegrityError:
+		db.session.rollback()
+		return None
+
+	# pandas is slow to import and only needed here, not by every worker
+	import pandas as pd
+
+	# Prepare every row at once: x, y and T columns, T is empty when missing
+	rows = pd.DataFrame(numeric, columns=['x', 'y', 't'][:numeric.shape[1]])
+	rows = rows.reindex(columns=['x', 'y', 't'])
+	rows.insert(0, 'component1_id', component1_id)
+	rows.insert(1, 'component2_id', component2_id)
+	# Associate a user id to the data if it exists
+	rows['user_id'] = int(user_id) if user_id else None
+
+	# Insert all rows in the session's transaction
+	if db.engine.dialect.name == 'postgresql':
+		_copy_rows(rows)
+	else:
+		records = rows.astype(object).where(rows.notna(), None).to_dict('records')
+		db.session.execute(VleData.__table__.insert(), records)
 	# Commit rows
 	db.session.commit()
 
+	# Drop any curve fitted from an older version of this dataset
+	invalidate_curve(component1_id, component2_id)
+
+	elapsed = time.perf_counter() - start
+	rows_per_second = len(rows) / elapsed if elapsed else float('inf')
+	current_app.logger.info('Uploaded %d VLE points in %.3f s (%.0f rows/s)',
+		len(rows), elapsed, rows_per_second)
+
+	return len(rows), rows_per_second
+
+
+def _copy_rows(rows):
+	"""
+	Streams the rows into vle_data with PostgreSQL's COPY, which skips the
+	per-row statement overhead of an INSERT
+	"""
+	buffer = io.StringIO()
+	rows.to_csv(buffer, header=False, index=False)
+	buffer.seek(0)
+
+	cursor = db.session.connection().connection.cursor()
+	cursor.copy_expert(
+		'COPY vle_data ({}) FROM STDIN WITH (FORMAT csv)'.format(', '.join(rows.columns)),
+		buffer
+	)
+
+
+def upload_vle_model(component1_id, component2_id, user_id, model, params):
+	"""
+	Defines the equilibrium of a component combination by an analytic model
+	and its parameters instead of data points. Raises ValueError if the
+	parameters are invalid, returns None if the combination already has a
+	dataset
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	# Building the curve checks the parameters
+	params = models.analytic_curve(model, params).params
+
+	db.session.add(VleDataset(
+		component1_id=component1_id,
+		component2_id=component2_id,
+		user_id=int(user_id) if user_id else None,
+		model=model,
+		params=json.dumps(params)
+	))
+	try:
+		db.session.commit()
+	except IntegrityError:
+		db.session.rollback()
+		return None
+
+	invalidate_curve(component1_id, component2_id)
+	return params
+
 ###############################################################################
 # GET COMMANDS
 ###############################################################################
+def get_component_index():
+	"""
+	Get the name search index of the component table from the component cache
+	"""
+	return component_cache.get(lambda: ComponentIndex(
+		db.session.query(Component.id, Component.name).order_by(Component.name).all()
+	))
+
+
+def search_components(query, partner_id=None, limit=20):
+	"""
+	Get the components whose name starts with or contains query. If
+	partner_id is given, only components with a dataset paired with it are
+	returned
+	"""
+	allowed = None
+	if partner_id is not None:
+		allowed = get_partner_ids(partner_id)
+
+	return get_component_index().search(query, allowed, limit)
+
+
+def get_partner_ids(component_id):
+	"""
+	Get the ids of every component that has a dataset paired with component_id
+	"""
+	partners = db.session.query(VleDataset.component2_id).\
+		filter(VleDataset.component1_id == component_id).union(
+		db.session.query(VleDataset.component1_id).\
+		filter(VleDataset.component2_id == component_id)).all()
+
+	return {partner for partner, in partners}
+
 # This section serves the requestor with the VLE data based on the components
 # specified
 def get_vle_from_components(component1_id, component2_id):
 	"""
-	Get VLE for component combination
+	Get VLE for component combination as a NumPy array
 	"""
 	# Swap component ids so the lower id is always component 1
 	if component2_id < component1_id:
@@ -83,19 +274,432 @@ def get_vle_from_components(component1_id, component2_id):
 		component1_id = temp2
 		component2_id = temp1
 	
-	# Query for data
-	dataset = VleData.query.filter_by(component1_id=component1_id).\
-		filter_by(component2_id=component2_id).order_by(VleData.id).all()
+	# Query for the numeric columns only, no ORM objects are built
+	with span('db'):
+		dataset = db.session.query(VleData.x, VleData.y, VleData.T).\
+			filter_by(component1_id=component1_id).\
+			filter_by(component2_id=component2_id).order_by(VleData.id).all()
+
+	# Return the points as an array with columns x, y and T (nan if missing)
+	return np.array(dataset, dtype=float).reshape(-1, 3)
+
+# Returns the fitted equilibrium curve for the component combination, fitting
+# it only when the dataset has changed since it was last cached
+def get_vle_curve(component1_id, component2_id):
+	"""
+	Get the fitted VLE curve for component combination from the curve cache,
+	returns None if there is no data for the combination
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	dataset = get_dataset(component1_id, component2_id)
+	if dataset is None:
+		return None
+
+	return _fitted_curve(component1_id, component2_id, dataset)
+
+
+def _fitted_curve(component1_id, component2_id, dataset):
+	"""
+	Returns the curve cached for this version of the dataset, building it on
+	a miss. Datasets with an analytic model are built from their stored
+	parameters without querying their points
+	"""
+	model = dataset_model(dataset)
+	key = (component1_id, component2_id, dataset.id, model)
+	curve = curve_cache.get(key)
+
+	if curve is None:
+		if dataset.model:
+			curve = models.analytic_curve(dataset.model, json.loads(dataset.params))
+		else:
+			points = get_vle_from_components(component1_id, component2_id)
+			with span('fit'):
+				curve = vle.fit_curve(points, model)
+		curve_cache.set(key, curve)
+
+	return curve
 
-	# Convert and return the dataframe to user	
-	return point_to_dataframe(dataset)
 
-# Helper function to convert VleData point data in postgresql to a dataframe
+# Steps off the stages for the component combination and design without
+# drawing the graph
+def get_vle_stages(component1_id, component2_id, xF, xD, xB, R, q):
+	"""
+	Get the StageResult for component combination and design, returns None
+	if there is no data for the combination
+	"""
+	curve = get_vle_curve(component1_id, component2_id)
+	if curve is None:
+		return None
+
+	with span('stages'):
+		return vle.calc_stages(curve, xF, xD, xB, R, q, current_app.config['MAX_STAGES'])
+
+
+# The minimum reflux ratio is only searched for when a pinch is reported,
+# stepping off the stages never needs it
+def get_minimum_reflux(component1_id, component2_id, xF, xD, xB, R, q):
+	"""
+	Get the minimum reflux ratio of a pinched design for component
+	combination, returns None if there is no data for the combination or not
+	even total reflux clears the curve
+	"""
+	curve = get_vle_curve(component1_id, component2_id)
+	if curve is None:
+		return None
+
+	with span('minimum_reflux'):
+		return vle.minimum_reflux(curve, xF, xD, xB, R, q)
+
+
+def get_vle_stages_batch(cases, pool_threshold=256):
+	"""
+	Steps off the stages of a batch of cases, each a tuple of
+	(component1_id, component2_id, xF, xD, xB, R, q). Cases of the same
+	component combination share one curve, batches larger than
+	pool_threshold are spread across the process pool. Returns a
+	StageResult for each case, None where there is no data
+	"""
+	# Group the cases by component combination
+	groups = {}
+	for index, case in enumerate(cases):
+		groups.setdefault(ordered_pair(case[0], case[1]), []).append(index)
+
+	results = [None] * len(cases)
+	futures = []
+	max_stages = current_app.config['MAX_STAGES']
+
+	for pair, indices in groups.items():
+		curve = get_vle_curve(*pair)
+		if curve is None:
+			continue
+
+		designs = [cases[index][2:] for index in indices]
+		if len(cases) > pool_threshold:
+			for part, part_designs in zip(chunk(indices, pool_size()), chunk(designs, pool_size())):
+				futures.append((part, get_pool().submit(vle.calc_batch, curve, part_designs, max_stages)))
+		else:
+			for index, result in zip(indices, vle.calc_batch(curve, designs, max_stages)):
+				results[index] = result
+
+	# Collect the cases that ran in the pool
+	for part, future in futures:
+		for index, result in zip(part, future.result()):
+			results[index] = result
+
+	return results
+
+
+# Prices the column built from a design with the break-even model of
+# heat_duty.py, reusing the stepping and temperatures cached for the
+# combination
+def get_vle_cost(component1_id, component2_id, xF, xD, xB, R, q, plant, Tw=None):
+	"""
+	Get the cost of the column for component combination and design. plant
+	holds the keys of heat_duty.PLANT_DEFAULTS. Tw, the temperature of the
+	bottom stage in K, is read from the T column of the dataset unless
+	given. Returns None if there is no data for the combination, otherwise
+	the StageResult, the number of real stages, Tw and the CostBreakdown.
+	Raises ValueError if the design can't be priced, explaining any pinch
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	dataset = get_dataset(component1_id, component2_id)
+	if dataset is None:
+		return None
+
+	result = _cached_stages(component1_id, component2_id, dataset, xF, xD, xB, R, q)
+	if result.pinch is not None:
+		curve = _fitted_curve(component1_id, component2_id, dataset)
+		raise ValueError(vle.describe_pinch(result.pinch, vle.minimum_reflux(curve, xF, xD, xB, R, q)))
+	if result.nstage >= current_app.config['MAX_STAGES']:
+		raise ValueError('Parameters resulted in invalid calculation')
+
+	Tw = float(np.interp(result.x[-1], *_bottom_profile(component1_id, component2_id, dataset, Tw)))
+
+	# The reboiler is heated with 365.86 F steam
+	if (Tw - 273.15) * (9 / 5) + 32 >= 365.86:
+		raise ValueError('The bottom stage must be colder than the 365.86 F reboiler steam')
+
+	nstage = vle.calc_nstages(result.nstage, plant['efficiency'])
+	with span('cost'):
+		costs = optimize.column_cost(result.nstage, R, q, Tw, xF, xD, xB, plant)
+
+	return result, nstage, Tw, costs
+
+
+# Finds the reflux ratio with the lowest break-even cost for a design,
+# stepping off the stages at as few reflux ratios as it can
+def get_reflux_optimum(component1_id, component2_id, xF, xD, xB, q, plant, R_min, R_max,
+		Tw=None, points=100, tol=1e-4):
+	"""
+	Get the RefluxOptimum between R_min and R_max for component combination
+	and design, with plant and Tw as in get_vle_cost. Returns None if there
+	is no data for the combination. Raises ValueError if no reflux ratio
+	can be priced
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	dataset = get_dataset(component1_id, component2_id)
+	if dataset is None:
+		return None
+
+	profile = _bottom_profile(component1_id, component2_id, dataset, Tw)
+
+	def step(R):
+		return _cached_stages(component1_id, component2_id, dataset, xF, xD, xB, R, q)
+
+	return optimize.optimize_reflux(step, lambda x: np.interp(x, *profile), xF, xD, xB, q, plant,
+		R_min, R_max, points, tol, current_app.config['MAX_STAGES'])
+
+
+# Finds the feed temperature and reflux ratio with the lowest break-even
+# cost together, q follows from the feed temperature
+def get_feed_optimum(component1_id, component2_id, xF, xD, xB, plant, R_min, R_max, TF_min, TF_max,
+		Tw=None, TF_points=8, points=100, tol=1e-4, TF_tol=0.1):
+	"""
+	Get the FeedOptimum over R between R_min and R_max and TF between
+	TF_min and TF_max for component combination and design, with plant and
+	Tw as in get_vle_cost. The cheapest reflux ratio is found at TF_points
+	evenly spaced feed temperatures in parallel across the process pool,
+	then the best of them is refined to within TF_tol. Stage results are
+	cached per q-line, so every optimization at the same q reuses them.
+	Returns None if there is no data for the combination. Raises ValueError
+	if no feed temperature can be priced
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	dataset = get_dataset(component1_id, component2_id)
+	if dataset is None:
+		return None
+
+	curve = _fitted_curve(component1_id, component2_id, dataset)
+	profile = _bottom_profile(component1_id, component2_id, dataset, Tw)
+	model = dataset_model(dataset)
+	args = (curve, profile, xF, xD, xB)
+	options = (plant, R_min, R_max, points, tol)
+	max_stages = current_app.config['MAX_STAGES']
+
+	def qline_key(TF):
+		return (component1_id, component2_id, dataset.id, model, max_stages, xF, xD, xB,
+			optimize.feed_quality(TF, xF, plant))
+
+	# Cheapest reflux ratio at each feed temperature tried, None where
+	# nothing could be priced
+	optima = {}
+	steppings = [0]
+
+	def finish(TF, known, run):
+		try:
+			optimum, steps = run()
+		except ValueError:
+			optima[TF] = None
+			return
+		steppings[0] += len(steps) - len(known)
+		reflux_cache.set(qline_key(TF), steps)
+		optima[TF] = optimum
+
+	def total(TF):
+		if TF not in optima:
+			known = reflux_cache.get(qline_key(TF)) or {}
+			finish(TF, known, lambda: optimize.optimize_feed(*args, TF, *options, known, max_stages))
+
+		return optimize.total_cost(optima[TF].costs) if optima[TF] else math.inf
+
+	with span('stages'):
+		# Every feed temperature of the grid has its own q-line, run them in parallel
+		TF_grid = np.linspace(TF_min, TF_max, TF_points)
+		futures = []
+		for TF in TF_grid:
+			known = reflux_cache.get(qline_key(TF)) or {}
+			futures.append((TF, known, get_pool().submit(optimize.optimize_feed, *args, TF, *options, known,
+				max_stages)))
+		for TF, known, future in futures:
+			finish(TF, known, future.result)
+
+		totals = [total(TF) for TF in TF_grid]
+		index = int(np.argmin(totals))
+		if math.isinf(totals[index]):
+			raise ValueError('No feed temperature between TF_min and TF_max gives a column that can be priced')
+
+		# Refine between the neighbours of the cheapest feed temperature
+		optimize.golden_section(total, TF_grid[max(index - 1, 0)], TF_grid[min(index + 1, TF_points - 1)], TF_tol)
+
+	TF = min(optima, key=total)
+	feeds = [(TF_tried, optimize.feed_quality(TF_tried, xF, plant), optima[TF_tried].R,
+		optima[TF_tried].nstage, total(TF_tried)) for TF_tried in sorted(optima) if optima[TF_tried]]
+
+	return optimize.FeedOptimum(TF, optimize.feed_quality(TF, xF, plant), optima[TF], feeds, steppings[0])
+
+
+def _bottom_profile(component1_id, component2_id, dataset, Tw=None):
+	"""
+	Returns the x and T the temperature in K of a bottom stage is
+	interpolated from, the T column of the dataset or Tw everywhere when
+	given. Raises ValueError if neither has a temperature
+	"""
+	if Tw is not None:
+		return np.array([0.0, 1.0]), np.array([Tw, Tw])
+
+	x_profile, T_profile = _temperature_profile(component1_id, component2_id, dataset)
+	if not len(x_profile):
+		raise ValueError('The data for this combination has no temperatures, give Tw')
+
+	return x_profile, T_profile
+
+
+def _cached_stages(component1_id, component2_id, dataset, xF, xD, xB, R, q):
+	"""
+	Returns the StageResult cached for this version of the dataset and
+	design, stepping it off on a miss
+	"""
+	max_stages = current_app.config['MAX_STAGES']
+	key = (component1_id, component2_id, dataset.id, dataset_model(dataset), max_stages, xF, xD, xB, R, q)
+	result = stage_cache.get(key)
+
+	if result is None:
+		curve = _fitted_curve(component1_id, component2_id, dataset)
+		with span('stages'):
+			result = vle.calc_stages(curve, xF, xD, xB, R, q, max_stages)
+		stage_cache.set(key, result)
+
+	return result
+
+
+def _temperature_profile(component1_id, component2_id, dataset):
+	"""
+	Returns the x and T of the points of the dataset that have a
+	temperature, sorted by x and cached for this version of the dataset.
+	Both are empty if the dataset has no temperatures
+	"""
+	key = (component1_id, component2_id, dataset.id)
+	profile = temperature_cache.get(key)
+
+	if profile is None:
+		points = get_vle_from_components(component1_id, component2_id)
+		points = points[~np.isnan(points[:, 2])]
+		points = points[np.argsort(points[:, 0], kind='stable')]
+		profile = (points[:, 0], points[:, 2])
+		temperature_cache.set(key, profile)
+
+	return profile
+
+
+def get_graph_key(component1_id, component2_id, xF, xD, xB, R, q, fmt='png'):
+	"""
+	Get the content-addressed key of the graph for component combination
+	and design, returns None if there is no data for the combination
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	dataset = get_dataset(component1_id, component2_id)
+	if dataset is None:
+		return None
+
+	return graph_key(component1_id, component2_id, dataset.id, dataset_model(dataset),
+		current_app.config['MAX_STAGES'], xF, xD, xB, R, q, fmt)
+
+
+# Returns the rendered McCabe-Thiele graph for the component combination and
+# design, rendering it only if an identical request has not been cached
+def get_vle_graph(component1_id, component2_id, xF, xD, xB, R, q, fmt='png'):
+	"""
+	Get the image bytes and number of stages of the graph for component
+	combination and design. Returns None if there is no data for the
+	combination, the image is None if the calculation did not converge
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	dataset = get_dataset(component1_id, component2_id)
+	if dataset is None:
+		return None
+
+	max_stages = current_app.config['MAX_STAGES']
+	key = graph_key(component1_id, component2_id, dataset.id, dataset_model(dataset),
+		max_stages, xF, xD, xB, R, q, fmt)
+	with span('cache'):
+		cached = graph_cache.get(key)
+	if cached is not None:
+		return unpack_graph(cached)
+
+	curve = _fitted_curve(component1_id, component2_id, dataset)
+	with span('draw'):
+		fig, nstage = vle.draw_graph(curve, xF, xD, xB, R, q, max_stages)
+
+	# Calculations that don't converge are cheap without drawing, skip them
+	if fig is None:
+		return None, nstage
+
+	with span('encode'):
+		image = vle.graph_image(fig, fmt)
+	with span('cache'):
+		graph_cache.set(key, pack_graph(image, nstage))
+
+	return image, nstage
+
+
+def get_dataset_version(component1_id, component2_id):
+	"""
+	Returns the id of the dataset, or None if there is none. Datasets are
+	never modified in place, so a re-upload always gets a new id, even when
+	another worker made it
+	"""
+	with span('db'):
+		return db.session.query(VleDataset.id).\
+			filter_by(component1_id=component1_id).\
+			filter_by(component2_id=component2_id).scalar()
+
+
+def get_dataset(component1_id, component2_id):
+	"""
+	Returns the id, model and params of the dataset, or None if there is none
+	"""
+	with span('db'):
+		return db.session.query(VleDataset.id, VleDataset.model, VleDataset.params).\
+			filter_by(component1_id=component1_id).\
+			filter_by(component2_id=component2_id).first()
+
+
+def dataset_model(dataset):
+	"""
+	Name of the curve model a dataset is calculated with
+	"""
+	return dataset.model or current_app.config['VLE_CURVE_MODEL']
+
+
+def dataset_exists(component1_id, component2_id):
+	"""
+	Checks whether the component combination already has a dataset
+	"""
+	component1_id, component2_id = ordered_pair(component1_id, component2_id)
+
+	return get_dataset_version(component1_id, component2_id) is not None
+
+
+def invalidate_curve(component1_id, component2_id):
+	"""
+	Removes every cached curve, stepping result and temperature profile of
+	the component combination
+	"""
+	pair = ordered_pair(component1_id, component2_id)
+	for cache in (curve_cache, stage_cache, temperature_cache, reflux_cache):
+		cache.invalidate(lambda key: key[:2] == pair)
+
+
+def ordered_pair(component1_id, component2_id):
+	"""
+	Returns the component ids as integers with the lower id first
+	"""
+	return tuple(sorted((int(component1_id), int(component2_id))))
+
+# Helper function to convert legacy VleData point strings to a dataframe
 def point_to_dataframe(dataset):
 	"""
 	Converts the point data from the VleData formatted as "x,y" to floats
 	in two dataframe columns
 	"""
+	import pandas as pd
+
 	# Initialize 2d array that will be converted to a dataframe
 	data = []
 
@@ -114,26 +718,37 @@ def point_to_dataframe(dataset):
 ###############################################################################
 # This section serves the requestor with the list of vle components they've
 # uploaded
-def get_user_vle_dict(user_id):
+def get_user_datasets(user_id, page=1, per_page=20):
 	"""
-	Based on user id, requests the rows inserted to the vle_data table by the
-	user specified. Returns a dictionary that contains the id combos and the
-	names
+	Based on user id, requests one page of the datasets uploaded by the user
+	specified with a single query. Returns the rows, each with the component
+	ids, component names and number of points, and the total number of
+	datasets the user has
 	"""
-	# Query the vle_table table for all data uploaded by the current user
-	user_vle = VleData.query.filter_by(user_id=user_id).all()
-	# Initialize a dictionary to hold the component id combos uploaded by user
-	component_combos = {}
+	component1 = aliased(Component)
+	component2 = aliased(Component)
+
+	# Points are only counted for the datasets on the page, using the index
+	npoints = db.session.query(db.func.count(VleData.id)).\
+		filter(VleData.component1_id == VleDataset.component1_id).\
+		filter(VleData.component2_id == VleDataset.component2_id).\
+		correlate(VleDataset).scalar_subquery()
+
+	datasets = db.session.query(
+		VleDataset.component1_id,
+		VleDataset.component2_id,
+		component1.name.label('component1_name'),
+		component2.name.label('component2_name'),
+		npoints.label('npoints')
+	).join(component1, component1.id == VleDataset.component1_id).\
+		join(component2, component2.id == VleDataset.component2_id).\
+		filter(VleDataset.user_id == user_id).\
+		order_by(component1.name, component2.name).\
+		limit(per_page).offset((page - 1) * per_page).all()
 
-	# Add a single instance of the component combos as a tuple key to the 
-	# dictionary and have the value be a string with the component names 
-	for row in user_vle:
-		key = (row.component1_id, row.component2_id)
-		if key not in component_combos:
-			component_combos[key] = Component.query.filter_by(id=row.component1_id).first().name \
-				+ " / " + Component.query.filter_by(id=row.component2_id).first().name
+	total = VleDataset.query.filter_by(user_id=user_id).count()
 
-	return component_combos
+	return datasets, total
 
 # Delete user uploaded data from the database
 def delete_user_data(component1_id, component2_id, user_id):
@@ -145,7 +760,10 @@ def delete_user_data(component1_id, component2_id, user_id):
 	# Query for all rows that match the 
 	VleData.query.filter_by(component1_id=component1_id).\
         filter_by(component2_id=component2_id).filter_by(user_id=user_id).delete()
+	VleDataset.query.filter_by(component1_id=component1_id).\
+		filter_by(component2_id=component2_id).filter_by(user_id=user_id).delete()
 	db.session.commit()
+	invalidate_curve(component1_id, component2_id)
 	
 	# Call delete_empty_component to possibly delete components if no data exists
 	delete_empty_component(component1_id)
@@ -156,11 +774,14 @@ def delete_empty_component(component_id):
 	"""
 	Deletes a component if no data is associated with it
 	"""
-	# Flag whether data for the component exists in col1 or col2 
-	data_in_col1 = VleData.query.filter_by(component1_id=component_id).first()
-	data_in_col2 = VleData.query.filter_by(component2_id=component_id).first()
+	# Flag whether a dataset for the component exists in col1 or col2 
+	has_data = db.session.query(VleDataset.query.filter(or_(
+		VleDataset.component1_id == component_id,
+		VleDataset.component2_id == component_id
+	)).exists()).scalar()
 
 	# Delete component from database if it does have associated data
-	if data_in_col1 is None and data_in_col2 is None:
+	if not has_data:
 		Component.query.filter_by(id=component_id).delete()
-		db.session.commit()
\ No newline at end of file
+		db.session.commit()
+		component_cache.bump()
\ No newline at end of file
@@ -0,0 +1,305 @@
+# ***************************************************************************
+# * Distillation Column Calculation - jobs.py
+# * Spencer Wagner
+# *
+# * Background jobs for calculations too long for a request. Job state lives
+# * in the job table and the work runs in a local process pool, so no
+# * outside broker is needed
+# ***************************************************************************
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+import json
+import time
+import uuid
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, select, update
+
+from .models import Job, VleData, VleDataset
+from .extensions import db
+import static.py.VLE_graph as vle
+import static.py.VLE_models as models
+from static.py.pool import get_pool, reset_pool
+
+# Seconds between progress updates written by a running job
+PROGRESS_INTERVAL = 0.5
+
+
+class JobCancelled(Exception):
+	"""
+	Raised inside a job when it has been asked to stop
+	"""
+
+
+def _now():
+	"""
+	Current UTC time as stored in the job table
+	"""
+	return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+###############################################################################
+# JOB KINDS
+###############################################################################
+# Each kind has a function that checks the parameters, returning an error
+# message or None, and a function that runs the job. The runner is called
+# with the fitted curve of the job's components, its parameters and a
+# report(fraction) callback that raises JobCancelled once the job is
+# cancelled
+def check_reflux_sweep(params):
+	if not 2 <= params['points'] <= 10000:
+		return 'points must be between 2 and 10000'
+	if not 0 < params['R_min'] < params['R_max']:
+		return 'Reflux ratios must satisfy 0 < R_min < R_max'
+
+	return vle.check_design(params['xF'], params['xD'], params['xB'], params['R_min'], params['q'])
+
+
+def run_reflux_sweep(curve, params, report, max_stages=vle.MAX_STAGES):
+	"""
+	Steps off the stages at evenly spaced reflux ratios, ratios below the
+	minimum reflux ratio are rejected without stepping
+	"""
+	R_values = np.linspace(params['R_min'], params['R_max'], params['points'])
+	nstages = []
+
+	for index, R in enumerate(R_values):
+		result = vle.calc_stages(curve, params['xF'], params['xD'], params['xB'], R, params['q'], max_stages)
+		nstages.append(result.nstage if result.nstage < max_stages else None)
+		report((index + 1) / len(R_values))
+
+	return {'R': R_values.tolist(), 'nstage': nstages}
+
+
+JOB_KINDS = {
+	'reflux_sweep': {
+		'params': {'component1': int, 'component2': int, 'xF': float, 'xD': float,
+			'xB': float, 'q': float, 'R_min': float, 'R_max': float, 'points': int},
+		'check': check_reflux_sweep,
+		'run': run_reflux_sweep
+	}
+}
+
+
+###############################################################################
+# WEB SIDE
+###############################################################################
+def parse_job_params(kind, params):
+	"""
+	Converts the parameters of a job to the types its kind expects. Returns
+	the parameters and an error message, which is None if they are valid
+	"""
+	if kind not in JOB_KINDS:
+		return None, 'Unknown job kind, use one of: {}'.format(', '.join(sorted(JOB_KINDS)))
+
+	types = JOB_KINDS[kind]['params']
+	try:
+		params = {name: convert(params[name]) for name, convert in types.items()}
+	except (KeyError, TypeError, ValueError):
+		return None, 'A {} job needs {}'.format(kind, ', '.join(types))
+
+	return params, JOB_KINDS[kind]['check'](params)
+
+
+def submit_job(kind, params, user_id=None):
+	"""
+	Records a job with parsed parameters and hands it to the job pool.
+	Returns the job id
+	"""
+	purge_expired_jobs()
+
+	job = Job(
+		id=uuid.uuid4().hex,
+		kind=kind,
+		status='queued',
+		params=json.dumps(params),
+		user_id=user_id,
+		created_at=_now()
+	)
+	db.session.add(job)
+	db.session.commit()
+
+	args = (run_job, job.id, current_app.config['SQLALCHEMY_DATABASE_URI'],
+		current_app.config['JOB_RESULT_TTL'], current_app.config['VLE_CURVE_MODEL'],
+		current_app.config['MAX_STAGES'])
+	try:
+		get_pool('jobs', current_app.config['JOB_WORKERS']).submit(*args)
+	except BrokenProcessPool:
+		# A worker died, start a new pool. The job stays queued in the table
+		# either way, so `flask run_jobs` can still pick it up
+		reset_pool('jobs')
+		get_pool('jobs', current_app.config['JOB_WORKERS']).submit(*args)
+
+	return job.id
+
+
+def get_job(job_id, user_id=None):
+	"""
+	Get a job by id, None if there is no such job. A job submitted by a
+	signed in user is only found for that user_id
+	"""
+	job = db.session.get(Job, job_id)
+	if job is None or (job.user_id is not None and job.user_id != user_id):
+		return None
+
+	return job
+
+
+def cancel_job(job_id, user_id=None):
+	"""
+	Asks a job to stop. A queued job is cancelled at once, a running job
+	stops at its next progress report. Returns the job, None if there is
+	no such job for user_id as in get_job
+	"""
+	job = get_job(job_id, user_id)
+	if job is None:
+		return None
+
+	if job.status in ('queued', 'running'):
+		job.cancel_requested = True
+	if job.status == 'queued':
+		job.status = 'cancelled'
+		job.finished_at = _now()
+		job.expires_at = job.finished_at + timedelta(seconds=current_app.config['JOB_RESULT_TTL'])
+	db.session.commit()
+
+	return job
+
+
+def job_expired(job):
+	"""
+	True once the result of a finished job is past its expiry time
+	"""
+	return job.expires_at is not None and job.expires_at < _now()
+
+
+def purge_expired_jobs():
+	"""
+	Deletes the jobs whose results have expired
+	"""
+	Job.query.filter(Job.expires_at < _now()).delete()
+	db.session.commit()
+
+
+@click.command(name='purge_jobs')
+@with_appcontext
+def purge_jobs():
+	"""
+	Deletes the jobs whose results have expired
+	"""
+	purge_expired_jobs()
+
+
+@click.command(name='run_jobs')
+@with_appcontext
+def run_queued_jobs():
+	"""
+	Runs every queued job in this process, for jobs left behind by a web
+	worker that stopped or to run a dedicated job worker
+	"""
+	queued = db.session.query(Job.id).filter_by(status='queued').order_by(Job.created_at).all()
+	for job_id, in queued:
+		run_job(job_id, current_app.config['SQLALCHEMY_DATABASE_URI'],
+			current_app.config['JOB_RESULT_TTL'], current_app.config['VLE_CURVE_MODEL'],
+			current_app.config['MAX_STAGES'])
+	click.echo('Ran {} jobs'.format(len(queued)))
+
+
+###############################################################################
+# WORKER SIDE
+###############################################################################
+# Workers have no Flask app, they reach the job table through their own engine
+_engines = {}
+
+
+def _engine(database_uri):
+	if database_uri not in _engines:
+		_engines[database_uri] = create_engine(database_uri)
+
+	return _engines[database_uri]
+
+
+def _load_curve(connection, component1_id, component2_id, model):
+	"""
+	Fits the equilibrium curve of the component combination, or builds it
+	from the stored parameters of its analytic model
+	"""
+	component1_id, component2_id = sorted((component1_id, component2_id))
+	dataset = connection.execute(
+		select(VleDataset.model, VleDataset.params).
+		where(VleDataset.component1_id == component1_id).
+		where(VleDataset.component2_id == component2_id)
+	).first()
+	if dataset is None:
+		return None
+	if dataset.model:
+		return models.analytic_curve(dataset.model, json.loads(dataset.params))
+
+	rows = connection.execute(
+		select(VleData.x, VleData.y, VleData.T).
+		where(VleData.component1_id == component1_id).
+		where(VleData.component2_id == component2_id).
+		order_by(VleData.id)
+	).all()
+
+	if not rows:
+		return None
+	return vle.fit_curve(np.array(rows, dtype=float).reshape(-1, 3), model)
+
+
+def run_job(job_id, database_uri, result_ttl, curve_model='polyfit', max_stages=vle.MAX_STAGES):
+	"""
+	Runs a queued job, recording its progress, result or error in the job
+	table. Does nothing if the job was already claimed or cancelled
+	"""
+	engine = _engine(database_uri)
+	jobs = Job.__table__
+
+	# Claim the job so no other worker runs it too
+	with engine.begin() as connection:
+		claimed = connection.execute(
+			update(jobs).where(jobs.c.id == job_id).where(jobs.c.status == 'queued').
+			values(status='running', started_at=_now())
+		).rowcount
+		if not claimed:
+			return
+		job = connection.execute(select(jobs).where(jobs.c.id == job_id)).one()
+
+	last_report = [0.0]
+
+	def report(fraction):
+		# Write progress at most every PROGRESS_INTERVAL and check for cancellation
+		if time.monotonic() - last_report[0] < PROGRESS_INTERVAL and fraction < 1:
+			return
+		last_report[0] = time.monotonic()
+
+		with engine.begin() as connection:
+			connection.execute(update(jobs).where(jobs.c.id == job_id).values(progress=fraction))
+			cancelled = connection.execute(
+				select(jobs.c.cancel_requested).where(jobs.c.id == job_id)
+			).scalar()
+		if cancelled:
+			raise JobCancelled()
+
+	values = {}
+	try:
+		params = json.loads(job.params)
+		with engine.connect() as connection:
+			curve = _load_curve(connection, params['component1'], params['component2'], curve_model)
+		if curve is None:
+			raise ValueError('There is no data for this combination of components')
+
+		result = JOB_KINDS[job.kind]['run'](curve, params, report, max_stages)
+		values = {'status': 'done', 'progress': 1.0, 'result': json.dumps(result)}
+	except JobCancelled:
+		values = {'status': 'cancelled'}
+	except Exception as error:
+		values = {'status': 'failed', 'error': str(error)}
+
+	finished_at = _now()
+	values.update(finished_at=finished_at, expires_at=finished_at + timedelta(seconds=result_ttl))
+	with engine.begin() as connection:
+		connection.execute(update(jobs).where(jobs.c.id == job_id).values(**values))
@@ -0,0 +1,272 @@
+# ***************************************************************************
+# * Distillation Column Calculation - metrics.py
+# * Spencer Wagner
+# *
+# * Timing spans for the phases of a request and counts of the SQL it runs,
+# * reported per request in response headers and aggregated for the
+# * Prometheus /metrics page. Metrics are kept per worker process,
+# * Prometheus sums the workers
+# ***************************************************************************
+from collections import Counter as StatementCounter, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .cache import curve_cache, graph_cache, component_cache, stage_cache, temperature_cache
+from .cache import reflux_cache
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the queries per request histogram buckets
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Phase durations and SQL statements of the current request, None outside
+# a request
+_request_spans = ContextVar('request_spans', default=None)
+_request_start = ContextVar('request_start', default=None)
+_request_queries = ContextVar('request_queries', default=None)
+
+# SQL run by a request
+#   count    - number of statements executed
+#   seconds  - time spent executing them
+#   repeated - (statement, times) of each statement executed more than once,
+#              most repeated first, a sign of queries issued in a loop
+QueryStats = namedtuple('QueryStats', ['count', 'seconds', 'repeated'])
+
+
+class Counter:
+	"""
+	Monotonic counter with one value per combination of labels
+	"""
+	def __init__(self, name, help, labels=()):
+		self.name = name
+		self.help = help
+		self.labels = labels
+		self._values = {}
+		self._lock = Lock()
+
+	def inc(self, *label_values, amount=1):
+		with self._lock:
+			self._values[label_values] = self._values.get(label_values, 0) + amount
+
+	def render(self):
+		lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+		with self._lock:
+			for label_values, value in sorted(self._values.items()):
+				lines.append('{}{} {}'.format(self.name, _labels(self.labels, label_values), value))
+
+		return lines
+
+
+class Histogram:
+	"""
+	Cumulative histogram of durations in seconds with one series per
+	combination of labels
+	"""
+	def __init__(self, name, help, labels=(), buckets=BUCKETS):
+		self.name = name
+		self.help = help
+		self.labels = labels
+		self.buckets = buckets
+		self._series = {}
+		self._lock = Lock()
+
+	def observe(self, value, *label_values):
+		with self._lock:
+			# Bucket counts, the sum of the values and the number of values
+			series = self._series.setdefault(label_values, [[0] * len(self.buckets), 0.0, 0])
+			for index, bound in enumerate(self.buckets):
+				if value <= bound:
+					series[0][index] += 1
+			series[1] += value
+			series[2] += 1
+
+	def render(self):
+		lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+		bucket_labels = self.labels + ('le',)
+		with self._lock:
+			for label_values, (counts, total, observations) in sorted(self._series.items()):
+				for bound, count in zip(self.buckets, counts):
+					lines.append('{}_bucket{} {}'.format(
+						self.name, _labels(bucket_labels, label_values + (bound,)), count))
+				lines.append('{}_bucket{} {}'.format(
+					self.name, _labels(bucket_labels, label_values + ('+Inf',)), observations))
+				lines.append('{}_sum{} {}'.format(self.name, _labels(self.labels, label_values), total))
+				lines.append('{}_count{} {}'.format(self.name, _labels(self.labels, label_values), observations))
+
+		return lines
+
+
+def _labels(names, values):
+	"""
+	Formats label names and values as {name="value",...}
+	"""
+	if not names:
+		return ''
+
+	pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+		for name, value in zip(names, values)]
+	return '{' + ','.join(pairs) + '}'
+
+
+# Requests handled, by endpoint, method and status code
+requests_total = Counter('distillation_requests_total', 'Requests handled',
+	('endpoint', 'method', 'status'))
+
+# Time spent on whole requests and on each phase within them
+request_seconds = Histogram('distillation_request_seconds', 'Request latency in seconds', ('endpoint',))
+phase_seconds = Histogram('distillation_phase_seconds', 'Time spent in each phase of a request in seconds',
+	('phase',))
+
+# SQL statements run by requests, and the latency of every statement
+queries_total = Counter('distillation_queries_total', 'SQL statements run by requests', ('endpoint',))
+request_queries = Histogram('distillation_request_queries', 'SQL statements per request', ('endpoint',),
+	buckets=QUERY_BUCKETS)
+query_seconds = Histogram('distillation_query_seconds', 'SQL statement latency in seconds')
+
+
+@contextmanager
+def span(phase):
+	"""
+	Times the block as one phase of the current request. Phases that run
+	more than once in a request are added together
+	"""
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		record(phase, time.perf_counter() - start)
+
+
+def record(phase, seconds):
+	"""
+	Adds seconds to a phase of the current request, for phases timed
+	without span
+	"""
+	phase_seconds.observe(seconds, phase)
+
+	spans = _request_spans.get()
+	if spans is not None:
+		spans[phase] = spans.get(phase, 0.0) + seconds
+
+
+def start_request():
+	"""
+	Starts timing the request handled by this thread
+	"""
+	_request_spans.set({})
+	_request_start.set(time.perf_counter())
+	# Times each statement ran and the total time spent running them
+	_request_queries.set([StatementCounter(), 0.0])
+
+
+def finish_request(endpoint, method, status):
+	"""
+	Records the request in the metrics. Returns its phase durations in
+	seconds, in the order they first ran, and its total duration
+	"""
+	spans = _request_spans.get() or {}
+	start = _request_start.get()
+	total = time.perf_counter() - start if start is not None else 0.0
+	_request_spans.set(None)
+	_request_start.set(None)
+
+	requests_total.inc(endpoint, method, status)
+	request_seconds.observe(total, endpoint)
+
+	return spans, total
+
+
+def finish_queries(endpoint):
+	"""
+	Records the SQL run by the current request in the metrics and returns
+	its QueryStats
+	"""
+	queries = _request_queries.get()
+	_request_queries.set(None)
+	if queries is None:
+		return QueryStats(0, 0.0, [])
+
+	statements, seconds = queries
+	count = sum(statements.values())
+	queries_total.inc(endpoint, amount=count)
+	request_queries.observe(count, endpoint)
+
+	repeated = [(statement, times) for statement, times in statements.most_common() if times > 1]
+	return QueryStats(count, seconds, repeated)
+
+
+def track_queries(logger, slow_seconds):
+	"""
+	Counts and times every SQL statement run by any engine. Statements that
+	take longer than slow_seconds are logged as warnings, statements that
+	fail are not counted
+	"""
+	if event.contains(Engine, 'before_cursor_execute', _before_execute):
+		return
+
+	def after_execute(conn, cursor, statement, parameters, context, executemany):
+		elapsed = time.perf_counter() - conn.info['query_start'].pop()[1]
+		query_seconds.observe(elapsed)
+
+		queries = _request_queries.get()
+		if queries is not None:
+			queries[0][statement] += 1
+			queries[1] += elapsed
+
+		if elapsed > slow_seconds:
+			logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, statement)
+
+	event.listen(Engine, 'before_cursor_execute', _before_execute)
+	event.listen(Engine, 'after_cursor_execute', after_execute)
+	event.listen(Engine, 'handle_error', _handle_error)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+	conn.info.setdefault('query_start', []).append((context, time.perf_counter()))
+
+
+def _handle_error(exception_context):
+	# after_cursor_execute never runs for a failed statement, drop its start
+	# so the next statement on the pooled connection isn't timed from it
+	conn = exception_context.connection
+	starts = conn.info.get('query_start') if conn is not None else None
+	if starts and starts[-1][0] is exception_context.execution_context:
+		starts.pop()
+
+
+def server_timing(spans, total=None):
+	"""
+	Formats phase durations in seconds as a Server-Timing header value
+	"""
+	timings = ['{};dur={:.2f}'.format(phase, seconds * 1000) for phase, seconds in spans.items()]
+	if total is not None:
+		timings.append('total;dur={:.2f}'.format(total * 1000))
+
+	return ', '.join(timings)
+
+
+def render_metrics():
+	"""
+	All metrics in the Prometheus text format, including the hit ratios of
+	the caches
+	"""
+	lines = requests_total.render() + request_seconds.render() + phase_seconds.render() + \
+		queries_total.render() + request_queries.render() + query_seconds.render()
+
+	caches = {'curve': curve_cache, 'graph': graph_cache, 'component': component_cache,
+		'stage': stage_cache, 'temperature': temperature_cache, 'reflux': reflux_cache}
+	stats = {name: cache.stats() for name, cache in caches.items()}
+	for field, kind, help in (('hits', 'counter', 'Cache hits'), ('misses', 'counter', 'Cache misses'),
+			('hit_ratio', 'gauge', 'Fraction of cache lookups that hit')):
+		name = 'distillation_cache_{}{}'.format(field, '_total' if kind == 'counter' else '')
+		lines += ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind)]
+		for cache_name, cache_stats in stats.items():
+			lines.append('{}{} {}'.format(name, _labels(('cache',), (cache_name,)), cache_stats[field]))
+
+	return '\n'.join(lines) + '\n'
@@ -29,10 +29,51 @@ class Component(db.Model):
 class VleData(db.Model):
 	__table_args__ = (
 		db.CheckConstraint('component1_id != component2_id'),
+		db.Index('ix_vle_data_components', 'component1_id', 'component2_id'),
+		db.Index('ix_vle_data_user_id', 'user_id'),
 	)
 	id = db.Column(db.Integer, primary_key=True)
 	component1_id = db.Column(db.Integer, db.ForeignKey('component.id'))
 	component2_id = db.Column(db.Integer, db.ForeignKey('component.id'))
+	# Legacy "x,y" or "x,y,T" string, superseded by the numeric columns
 	point = db.Column(db.String(50))
+	x = db.Column(db.Float)
+	y = db.Column(db.Float)
+	T = db.Column('t', db.Float, nullable=True)
 	user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
 
+
+# One row per uploaded VLE dataset. Component ids are stored lowest first, so
+# the unique constraint allows only one dataset for a pair of components
+class VleDataset(db.Model):
+	__table_args__ = (
+		db.CheckConstraint('component1_id < component2_id'),
+		db.UniqueConstraint('component1_id', 'component2_id', name='uq_vle_dataset_components'),
+	)
+	id = db.Column(db.Integer, primary_key=True)
+	component1_id = db.Column(db.Integer, db.ForeignKey('component.id'), nullable=False)
+	component2_id = db.Column(db.Integer, db.ForeignKey('component.id'), nullable=False, index=True)
+	user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+	# Analytic model of the pair and its parameters as JSON, see
+	# VLE_models.ANALYTIC_MODELS. Without one the points are fitted with the
+	# app's VLE_CURVE_MODEL
+	model = db.Column(db.String(20), nullable=True)
+	params = db.Column(db.Text, nullable=True)
+
+
+# Background job, its state is kept here so any worker can report on it
+class Job(db.Model):
+	id = db.Column(db.String(32), primary_key=True)
+	kind = db.Column(db.String(50), nullable=False)
+	# queued, running, done, failed or cancelled
+	status = db.Column(db.String(20), nullable=False, index=True)
+	progress = db.Column(db.Float, nullable=False, default=0.0)
+	cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+	params = db.Column(db.Text, nullable=False)
+	result = db.Column(db.Text)
+	error = db.Column(db.Text)
+	user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+	created_at = db.Column(db.DateTime, nullable=False)
+	started_at = db.Column(db.DateTime)
+	finished_at = db.Column(db.DateTime)
+	expires_at = db.Column(db.DateTime, index=True)
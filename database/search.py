@@ -0,0 +1,72 @@
+# ***************************************************************************
+# * Distillation Column Calculation - search.py
+# * Spencer Wagner
+# *
+# * Name search over the component table for the typeahead on the index page
+# ***************************************************************************
+from bisect import bisect_left, bisect_right
+
+
+class ComponentIndex:
+	"""
+	Prefix and substring index over component names, built once per version
+	of the component table. components holds (id, name) rows in
+	alphabetical order
+	"""
+	def __init__(self, components):
+		self.components = components
+
+		# Lowercase names sorted for prefix lookups by binary search
+		self._by_name = sorted((name.lower(), i) for i, (_, name) in enumerate(components))
+		self._names = [name for name, _ in self._by_name]
+
+		# Every name in one string, so substrings are found by str.find in C
+		# instead of testing each name in Python
+		self._text = '\n'.join(self._names)
+		self._starts = []
+		offset = 0
+		for name in self._names:
+			self._starts.append(offset)
+			offset += len(name) + 1
+
+	def search(self, query, allowed=None, limit=20):
+		"""
+		Returns up to limit components whose name starts with query, followed
+		by those that only contain it. allowed is an optional set of component
+		ids to restrict the results to
+		"""
+		if limit <= 0:
+			return []
+
+		query = query.strip().lower().replace('\n', ' ')
+		found = []
+		seen = set()
+
+		def add(position):
+			row = self.components[self._by_name[position][1]]
+			if position not in seen and (allowed is None or row[0] in allowed):
+				seen.add(position)
+				found.append(row)
+			return len(found) >= limit
+
+		# Names starting with the query are a contiguous run of the sorted list
+		start = bisect_left(self._names, query)
+		end = bisect_right(self._names, query + '\uffff')
+		for position in range(start, end):
+			if add(position):
+				return found
+
+		if not query:
+			return found
+
+		# Then names containing the query anywhere
+		offset = self._text.find(query)
+		while offset != -1:
+			position = bisect_right(self._starts, offset) - 1
+			if add(position):
+				return found
+			# Skip to the next name, one match per name is enough
+			next_start = self._starts[position + 1] if position + 1 < len(self._starts) else len(self._text)
+			offset = self._text.find(query, next_start)
+
+		return found
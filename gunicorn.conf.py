@@ -0,0 +1,17 @@
+# ***************************************************************************
+# * Distillation Tower - Cost Minimization Project
+# * Spencer Wagner
+# * gunicorn settings, see the Procfile
+# ***************************************************************************
+import os
+
+
+def post_worker_init(worker):
+    """
+    Loads matplotlib, the graph font and the Agg renderer in each worker
+    before it accepts requests, so the first graph it serves is not slowed
+    by them. Set WARM_UP=0 to skip
+    """
+    if os.getenv('WARM_UP', '1') == '1':
+        from static.py.VLE_graph import warm_up
+        warm_up()
@@ -6,16 +6,60 @@
 # * of stages that are optimal for cost
 # ***************************************************************************
 
-#Import required packages
-import matplotlib.pyplot as plt
+#Import required packages, matplotlib is imported by the functions that draw
+#so calculations that don't draw never load it
 import numpy.polynomial.polynomial as poly
-from matplotlib import cm
-from pandas.core.base import DataError
 import numpy as np
-import pandas as pd
 import math
 import io
 import base64
+from collections import namedtuple
+from functools import partial
+
+import static.py.VLE_models as models
+
+
+# Stepping stops after this many stages by default, more stages than this
+# means the design is not feasible
+MAX_STAGES = 100
+
+# Relative precision the minimum reflux ratio of a Pinch is found to
+RMIN_RTOL = 1e-4
+
+# Result of stepping off the stages of a McCabe-Thiele diagram
+#   nstage     - number of theoretical stages
+#   x          - liquid mole fraction of each corner, x[0] is xD and x[k] is
+#                the point on the equilibrium curve reached by stage k
+#   y          - vapor mole fraction of each horizontal step, stage k is
+#                stepped off at y[k - 1]
+#   feed_stage - first stage stepped down to the stripping line
+#   pinch      - Pinch of a design that does not converge, None otherwise.
+#                Designs failing check_intersection are not stepped off at
+#                all, x and y then only hold xD
+StageResult = namedtuple('StageResult', ['nstage', 'x', 'y', 'feed_stage', 'pinch'], defaults=(None,))
+
+# Where the operating lines touch or cross the equilibrium curve, so that
+# the stages pile up there and never reach xB
+#   x, y - point of the equilibrium curve the stages would pile up at
+Pinch = namedtuple('Pinch', ['x', 'y'])
+
+class FittedCurve(namedtuple('FittedCurve', ['x', 'y', 'y_max'])):
+	"""
+	Equilibrium curve fitted from a dataset, ready for stepping. Every curve
+	model has x and y to draw, evaluate, invert and envelope
+	  x, y  - fitted grid from get_data
+	  y_max - inverse_lookup of y
+	"""
+	__slots__ = ()
+
+	def evaluate(self, x):
+		return np.interp(x, self.x, self.y)
+
+	def invert(self, y):
+		return invert_curve(self.x, self.y_max, y)
+
+	def envelope(self):
+		return self.x, self.y_max
 
 # Import data
 def get_data(vle_data):
@@ -23,57 +67,145 @@ def get_data(vle_data):
 	Imports Vapor-Liquid equilibrium curve data from source
 	"""
 	# Grab the first and second columns of data separately
-	x_sep = vle_data.loc[:, 0]
-	y_sep = vle_data.loc[:, 1]
+	points = np.asarray(vle_data, dtype=float)
+	x_sep = points[:, 0]
+	y_sep = points[:, 1]
 
 	coefs = poly.polyfit(x_sep, y_sep, 10)
-	x_new = [1 / 5000 * i for i in range(5000)]
+	x_new = np.arange(5000) * (1 / 5000)
 	ffit = poly.polyval(x_new, coefs)
 	return x_new, ffit
 
 
+def inverse_lookup(y_sep):
+	"""
+	Precomputes the running maximum of the equilibrium curve. It is sorted,
+	so the first point where the curve reaches a vapor mole fraction can be
+	found with a binary search instead of scanning the whole curve
+	"""
+	return np.maximum.accumulate(np.asarray(y_sep, dtype=float))
+
+
+def invert_curve(x_sep, y_max, y_current):
+	"""
+	Returns the liquid mole fraction of the first point on the equilibrium
+	curve with a vapor mole fraction of at least y_current, or None if the
+	curve never gets there
+	"""
+	x_index = np.searchsorted(y_max, y_current, side='left')
+	if x_index == len(y_max):
+		return None
+
+	return x_sep[x_index]
+
+
+def fit_polynomial(vle_data):
+	"""
+	Fits the degree 10 polynomial of get_data, sampled on its grid
+	"""
+	x_sep, y_sep = get_data(vle_data)
+
+	return FittedCurve(x_sep, y_sep, inverse_lookup(y_sep))
+
+
+# Equilibrium curve models a dataset can be fitted with
+CURVE_MODELS = {
+	'polyfit': fit_polynomial,
+	'pchip': models.fit_pchip
+}
+CURVE_MODELS.update({name: partial(models.fit_analytic_curve, name) for name in models.ANALYTIC_MODELS})
+
+
+def fit_curve(vle_data, model='polyfit'):
+	"""
+	Fits the equilibrium curve of a dataset once so it can be reused for any
+	number of calculations, using one of CURVE_MODELS
+	"""
+	if model not in CURVE_MODELS:
+		raise ValueError('Unknown curve model {!r}, use one of: {}'.format(model, ', '.join(CURVE_MODELS)))
+
+	return CURVE_MODELS[model](vle_data)
+
+
+def as_curve(vle_data):
+	"""
+	Returns vle_data as a fitted curve, fitting it if it is still a dataframe
+	"""
+	if hasattr(vle_data, 'invert'):
+		return vle_data
+
+	return fit_curve(vle_data)
+
+
+# Function to create a figure for a single graph
+def new_figure():
+	"""
+	Creates a figure with its own Agg canvas. Nothing is shared through
+	pyplot's global figure, so concurrent requests cannot draw on each
+	other's graphs
+	"""
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+	fig = Figure()
+	FigureCanvasAgg(fig)
+
+	return fig
+
+
 # Function to set up the graph
-def init_graph(x_sep, y_sep):
+def init_graph(ax, x_sep, y_sep):
 	"""
 	Draws the plot with the separation data of the two components at
 	vapor-liquid equilibrium
 	"""
 	# Plot x_sep and y_sep
-	plt.plot(x_sep, y_sep)
-	plt.plot(x_sep, x_sep)
-	plt.xlim([0, 1])
-	plt.ylim([0, 1])
+	ax.plot(x_sep, y_sep)
+	ax.plot(x_sep, x_sep)
+	ax.set_xlim([0, 1])
+	ax.set_ylim([0, 1])
 
 	# Label graph
-	plt.xlabel('Mole Fraction of X in Liquid', fontsize=18, fontname='Liberation Serif')
-	plt.ylabel('Mole Fraction of X in Vapor', fontsize=18, fontname='Liberation Serif')
-	plt.xticks(fontsize=12)
-	plt.yticks(fontsize=12)
+	ax.set_xlabel('Mole Fraction of X in Liquid', fontsize=18, fontname='Liberation Serif')
+	ax.set_ylabel('Mole Fraction of X in Vapor', fontsize=18, fontname='Liberation Serif')
+	ax.tick_params(labelsize=12)
 
 
 
+# Function to solve for the q line
+def solve_q(q, xF):
+	"""
+	Solve for the q line (q is the mole fraction of liquid in the feed),
+	returns the two points drawn and the line equation
+	"""
+	q_pntx = [xF, xF + 0.025]
+	q_pnty = [xF, q / (q - 1) * (xF + 0.025) - xF / (q - 1)]
+	q_line = np.polyfit(q_pntx, q_pnty, 1)
+
+	return q_pntx, q_pnty, q_line
+
+
 # Function to solve for and draw the q line
-def draw_q(q, xF):
+def draw_q(ax, q, xF):
 	"""
 	Solve for and draw the q line (q is the mole fraction of liquid in the
 	feed)
 	"""
 
 	#Solve for the q line
-	q_pntx = [xF, xF + 0.025]
-	q_pnty = [xF, q / (q - 1) * (xF + 0.025) - xF / (q - 1)]
-	q_line = np.polyfit(q_pntx, q_pnty, 1)
+	q_pntx, q_pnty, q_line = solve_q(q, xF)
 
 	# Add q line to the plot
-	plt.plot(q_pntx, q_pnty)
+	ax.plot(q_pntx, q_pnty)
 
 	# Return q line for drawing the enriching/stripping lines
 	return q_line
 
 
-def enriching_stripping(R, q_line, xD, xB):
+def solve_enriching_stripping(R, q_line, xD, xB):
 	"""
-	Solves for and draws the enriching and stripping lines on the plot
+	Solves for the enriching and stripping lines, returns both line equations
+	and the point where they cross the q line
 	"""
 
 	# Solve for the enriching line
@@ -83,116 +215,404 @@ def enriching_stripping(R, q_line, xD, xB):
 
 	# Find the point where the enriching line and q line intersect
 	intersect = np.roots(q_line - enr_line)[0]
-	enr_x = [intersect, xD]
-	enr_y = [np.polyval(enr_line, intersect), xD]
-
-	# Plot enriching line
-	plt.plot(enr_x, enr_y)
+	y_intersect = np.polyval(enr_line, intersect)
 
 	# Calculate stripping line 
 	strip_x = [xB, intersect]
-	strip_y = [xB, np.polyval(enr_line, intersect)]
+	strip_y = [xB, y_intersect]
 	strip_line = np.polyfit(strip_x, strip_y, 1)
 
+	return enr_line, strip_line, intersect, y_intersect
+
+
+def enriching_stripping(ax, R, q_line, xD, xB):
+	"""
+	Solves for and draws the enriching and stripping lines on the plot
+	"""
+	enr_line, strip_line, intersect, y_intersect = \
+		solve_enriching_stripping(R, q_line, xD, xB)
+
+	# Plot enriching line
+	ax.plot([intersect, xD], [y_intersect, xD])
+
 	# Plot stripping line
-	plt.plot(strip_x, strip_y)
+	strip_x = [xB, intersect]
+	strip_y = [xB, y_intersect]
+	ax.plot(strip_x, strip_y)
 
 	# Return enriching and stripping line for future calcs
 	return enr_line, strip_line
 
 
-def distillation_stages(x_sep, y_sep, xB, xD, enr_line, strip_line):
+def step_stages(x_sep, y_sep, xB, xD, enr_line, strip_line, y_max=None, invert=None,
+		max_stages=MAX_STAGES):
 	"""
-	This performs the McCabe-Thiele method for drawing the number of stages
-	required to meet the process requirements. 
+	Performs the McCabe-Thiele method for stepping off the number of stages
+	required to meet the process requirements, without drawing anything.
+	y_max is the inverse_lookup of y_sep, computed here if not given.
+	invert is the invert of a curve model, used instead of the grid when
+	given. Stops once more than max_stages are stepped off. Returns a
+	StageResult with the corners of every step
 	"""
-	# Initialize information for drawing lines
+	if invert is None:
+		if y_max is None:
+			y_max = inverse_lookup(y_sep)
+		invert = lambda y: invert_curve(x_sep, y_max, y)
+
+	# Initialize information for stepping
 	nstage = 0
 	x_current = xD
 	y_current = xD
+	x_corners = [xD]
+	y_corners = [xD]
+	feed_stage = None
 
 	while True:
-	
-		for x_index, x_frac in enumerate(x_sep):
-			y_frac = y_sep[x_index]
-		
-			if y_frac >= y_current:
-				plt.plot([x_sep[x_index], x_current], [y_current, y_current], 'k-')
-				x_current = x_sep[x_index]
-				break
-	
+
+		# Step across to the equilibrium curve, staying put if it is never reached
+		x_next = invert(y_current)
+		if x_next is not None:
+			x_current = x_next
+
 		nstage += 1
+		x_corners.append(x_current)
 
 		# Break out of calculation if number of stages is too high
-		if nstage > 100:
-			return nstage
-		# Exit condition: the stages have been drawn past the point where
-		# process requirements are met, return number of stages needed
-		if x_current < xB:
-			return nstage
+		# Exit condition: the stages have been stepped past the point where
+		# process requirements are met
+		if nstage > max_stages or x_current < xB:
+			break
 
 		y_enr_check = np.polyval(enr_line, x_current)
 		y_strip_check = np.polyval(strip_line, x_current)
 
-		
 		if y_enr_check < y_strip_check:
-			plt.plot([x_current, x_current], [y_current, y_enr_check], 'k-')
 			y_current = y_enr_check
 
 		else:
-			plt.plot([x_current, x_current], [y_current, y_strip_check], 'k-')
 			y_current = y_strip_check
+			# The first stage stepped down to the stripping line is the feed
+			if feed_stage is None:
+				feed_stage = nstage
+
+		y_corners.append(y_current)
+
+	if feed_stage is None:
+		feed_stage = nstage
 
+	return StageResult(nstage, np.array(x_corners), np.array(y_corners), feed_stage)
 
-def serve_graph():
+
+def draw_stages(ax, result):
 	"""
-	Returns a base64 encoded image of the plot to the user
+	Draws the stages of a StageResult on the plot
+	"""
+	x, y = result.x, result.y
+
+	for stage in range(1, result.nstage + 1):
+		ax.plot([x[stage], x[stage - 1]], [y[stage - 1], y[stage - 1]], 'k-')
+
+		# The last stage has no step down to the operating lines
+		if stage < len(y):
+			ax.plot([x[stage], x[stage]], [y[stage - 1], y[stage]], 'k-')
+
+
+def distillation_stages(ax, x_sep, y_sep, xB, xD, enr_line, strip_line):
+	"""
+	This performs the McCabe-Thiele method for drawing the number of stages
+	required to meet the process requirements. 
+	"""
+	result = step_stages(x_sep, y_sep, xB, xD, enr_line, strip_line)
+	draw_stages(ax, result)
+
+	return result.nstage
+
+
+def calc_stages(vle_data, xF, xD, xB, R, q, max_stages=MAX_STAGES):
+	"""
+	Performs the VLE calculations using the VLE data (a dataframe or a
+	fitted curve) and parameters provided without drawing the graph. Returns
+	a StageResult. Designs failing check_intersection are rejected without
+	stepping. This includes designs whose enriching line meets the q line at
+	or below xB, which used to be stepped down a meaningless stripping line
+	to a few stages. Designs that step past max_stages get the Pinch found
+	by find_pinch
+	"""
+	# Get the fitted x and y component separation data
+	curve = as_curve(vle_data)
+
+	pinch = check_intersection(curve, xF, xD, xB, R, q)
+	if pinch is not None:
+		return StageResult(max_stages + 1, np.array([xD]), np.array([xD]), max_stages + 1, pinch)
+
+	# Solve for the q, enriching and stripping lines
+	q_line = solve_q(q, xF)[2]
+	enr_line, strip_line = solve_enriching_stripping(R, q_line, xD, xB)[:2]
+
+	result = step_stages(curve.x, curve.y, xB, xD, enr_line, strip_line, invert=curve.invert,
+		max_stages=max_stages)
+
+	# Only a curve bending towards the lines away from the q line, a tangent
+	# pinch, gets this far without converging
+	if result.nstage >= max_stages:
+		result = result._replace(pinch=find_pinch(curve, xF, xD, xB, R, q))
+
+	return result
+
+
+def q_intersection(xF, xD, R, q):
+	"""
+	Point where the enriching line meets the q line, None if they are
+	parallel
+	"""
+	enr_slope, enr_intercept = R / (R + 1), xD / (R + 1)
+	q_slope, q_intercept = q / (q - 1), -xF / (q - 1)
+	if enr_slope == q_slope:
+		return None
+
+	x = (q_intercept - enr_intercept) / (enr_slope - q_slope)
+	return x, enr_slope * x + enr_intercept
+
+
+def check_intersection(curve, xF, xD, xB, R, q):
+	"""
+	Checks the design before stepping with a single point: the enriching
+	line must meet the q line above xB and below the equilibrium curve.
+	Returns a Pinch where it doesn't, None otherwise
+	"""
+	point = q_intersection(xF, xD, R, q)
+	if point is None:
+		return None
+
+	# Stepping inverts the running maximum of the curve
+	x, y = point
+	x_curve, y_curve = curve.envelope()
+
+	# No stripping line can run from (xB, xB) to an intersection below xB
+	if x <= xB:
+		return Pinch(xB, float(np.interp(xB, x_curve, y_curve)))
+
+	y_intersect = float(np.interp(x, x_curve, y_curve))
+	if x < xD and y_intersect <= y:
+		return Pinch(float(x), y_intersect)
+
+	return None
+
+
+def operating_lines(x, xF, xD, xB, R, q):
+	"""
+	Vapor mole fraction of the operating lines at the liquid mole fractions
+	x, the lower of the enriching and stripping lines as in step_stages.
+	R may be an array, giving one row per reflux ratio
+	"""
+	R = np.asarray(R, dtype=float)[..., None]
+
+	# Enriching line through (xD, xD), q line through (xF, xF), and the
+	# stripping line from (xB, xB) to the point where they cross. When they
+	# cross at or below xB there is no stripping line, only the enriching one
+	enr_slope, enr_intercept = R / (R + 1), xD / (R + 1)
+	q_slope, q_intercept = q / (q - 1), -xF / (q - 1)
+	intersect = (q_intercept - enr_intercept) / (enr_slope - q_slope)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		strip_slope = np.where(intersect > xB,
+			(enr_slope * intersect + enr_intercept - xB) / (intersect - xB), np.inf)
+
+		return np.fmin(enr_slope * x + enr_intercept, xB + strip_slope * (x - xB))
+
+
+def envelope_between(curve, xB, xD):
+	"""
+	Grid and running maximum of the curve, the curve stepping inverts,
+	between xB and xD
+	"""
+	x, y = curve.envelope()
+	start, end = np.searchsorted(x, xB, side='left'), np.searchsorted(x, xD, side='right')
+
+	return x[start:end], y[start:end]
+
+
+def find_pinch(curve, xF, xD, xB, R, q):
+	"""
+	Compares the operating lines with the equilibrium curve between xB and
+	xD on the grid of the curve. Stepping can't get past a point where they
+	touch or cross, so returns a Pinch there, or None if the curve stays
+	above the lines
+	"""
+	x, y = envelope_between(curve, xB, xD)
+
+	gap = y - operating_lines(x, xF, xD, xB, R, q)
+	touching = np.flatnonzero(gap <= 0)
+	if not len(touching):
+		return None
+
+	# Stepping down from xD, the stages pile up at the highest such point
+	index = touching[-1]
+
+	return Pinch(float(x[index]), float(y[index]))
+
+
+def minimum_reflux(curve, xF, xD, xB, R, q, rtol=RMIN_RTOL):
+	"""
+	Smallest reflux ratio above R, to within rtol, that passes
+	check_intersection and whose operating lines stay below the curve
+	between xB and xD. None if even total reflux, which puts the lines on
+	the diagonal, touches the curve. Takes about a millisecond, only call it
+	to report a Pinch
+	"""
+	x, y = envelope_between(curve, xB, xD)
+	if np.min(y - x) <= 0:
+		return None
+
+	# The grid can step over the kink of the lines at the q line
+	def clears(R):
+		if check_intersection(curve, xF, xD, xB, R, q) is not None:
+			return False
+
+		return np.min(y - operating_lines(x, xF, xD, xB, R, q)) > 0
+
+	# Double R until the lines clear the curve, then bisect the last doubling
+	low, high = R, 2 * R if R > 0 else 1.0
+	while not clears(high):
+		low, high = high, 2 * high
+
+	while high - low > rtol * high:
+		middle = (low + high) / 2
+		if clears(middle):
+			high = middle
+		else:
+			low = middle
+
+	return float(high)
+
+
+def describe_pinch(pinch, R_min):
+	"""
+	Message explaining a Pinch to the user, with the R_min found by
+	minimum_reflux
+	"""
+	if R_min is None:
+		return ('The operating lines cross the equilibrium curve at x = {:.4f} even at total reflux, '
+			'xD is out of reach, for example past an azeotrope').format(pinch.x)
+
+	return ('The operating lines touch the equilibrium curve at x = {:.4f}, y = {:.4f}, '
+		'the reflux ratio must be above the minimum of {:.4g}').format(pinch.x, pinch.y, R_min)
+
+
+def check_design(xF, xD, xB, R, q):
+	"""
+	Returns a message describing why the design can't be stepped off, or
+	None if it can
+	"""
+	if not all(math.isfinite(value) for value in (xF, xD, xB, R, q)):
+		return 'Every parameter must be a number'
+	if not 0 < xB < xF < xD < 1:
+		return 'Mole fractions must satisfy 0 < xB < xF < xD < 1'
+	if R <= 0:
+		return 'Reflux ratio must be positive'
+	if q == 1:
+		return 'Quality of exactly 1 gives a vertical q line, use a value close to 1'
+
+	return None
+
+
+def calc_batch(vle_data, cases, max_stages=MAX_STAGES):
+	"""
+	Steps off the stages of every case, a sequence of (xF, xD, xB, R, q),
+	against one VLE dataset so the curve is only fitted once. Returns a
+	list of StageResult
+	"""
+	curve = as_curve(vle_data)
+
+	return [calc_stages(curve, *case, max_stages=max_stages) for case in cases]
+
+
+def graph_image(fig, fmt='png'):
+	"""
+	Returns the bytes of the plot saved as an image of the given format
 	"""
 	img = io.BytesIO()
-	plt.savefig(img, format='png')
-	img.seek(0)
+	fig.savefig(img, format=fmt)
 
+	return img.getvalue()
+
+
+def warm_up():
+	"""
+	Draws and encodes a throwaway graph so that matplotlib, the lookup of the
+	label font and the Agg renderer are loaded before the first request
+	rather than during it
+	"""
+	x = np.linspace(0, 1, 11)
+	fig = new_figure()
+	init_graph(fig.add_subplot(), x, x)
+	graph_image(fig)
+
+
+def serve_graph(fig):
+	"""
+	Returns a base64 encoded image of the plot to the user
+	"""
 	# Encodes png graph as 64 bit image
-	plot_url = base64.b64encode(img.getvalue()).decode()
+	plot_url = base64.b64encode(graph_image(fig)).decode()
 
 	return plot_url
 
 
 def calc_nstages(nstage, efficiency):
 	"""
-	Calculates the number of stages needed considering efficiency of each tray
+	Calculates the number of stages needed considering efficiency of each tray.
+	nstage may be an array, a nan stage count stays nan
 	"""
-	return math.ceil(nstage/efficiency)
+	with np.errstate(invalid='ignore'):
+		nstage_real = np.ceil(np.asarray(nstage, dtype=float) / efficiency)
+
+	if nstage_real.ndim:
+		return nstage_real
+	return int(nstage_real) if math.isfinite(nstage_real) else math.nan
 
 
-def do_graph(vle_data, xF, xD, xB, R, q):
+def draw_graph(vle_data, xF, xD, xB, R, q, max_stages=MAX_STAGES):
 	"""
-	Performs the VLE calculations using the VLE data and parameters provided
+	Performs the VLE calculations using the VLE data (a dataframe or a
+	fitted curve) and parameters provided, returns the figure with the graph
+	drawn and the number of stages. The figure is None if the calculation
+	did not converge
 	"""
-	# Clear plot
-	plt.clf()
+	# Get the fitted x and y component separation data
+	curve = as_curve(vle_data)
+	x_sep, y_sep = curve.x, curve.y
 
-	# Get the x and y component separation data
-	x_sep, y_sep = get_data(vle_data)
+	# Step off the stages before drawing anything
+	q_line = solve_q(q, xF)[2]
+	result = calc_stages(curve, xF, xD, xB, R, q, max_stages)
 
-	# Initialize the graph
-	init_graph(x_sep, y_sep)
+	# Something is wrong with the parameters, don't draw anything
+	if result.nstage >= max_stages:
+		return None, result.nstage
 
-	# Draw the q line and get the equation for said line
-	plt.figure(1)
-	q_line = draw_q(q, xF)
+	# Initialize a graph of our own for this calculation
+	fig = new_figure()
+	ax = fig.add_subplot()
+	init_graph(ax, x_sep, y_sep)
 
-	# Draw the enriching and stripping lines and the equation for both
-	plt.figure(1)
-	enr_line, strip_line = enriching_stripping(R, q_line, xD, xB)
+	# Draw the q line, the enriching and stripping lines and the stages
+	draw_q(ax, q, xF)
+	enriching_stripping(ax, R, q_line, xD, xB)
+	draw_stages(ax, result)
 
-	# Draw the number of distillation stages required and get the number of stages
-	plt.figure(1)
-	nstage = distillation_stages(x_sep, y_sep, xB, xD, enr_line, strip_line)
+	return fig, result.nstage
+
+
+def do_graph(vle_data, xF, xD, xB, R, q, max_stages=MAX_STAGES):
+	"""
+	Performs the VLE calculations using the VLE data (a dataframe or a
+	fitted curve) and parameters provided
+	"""
+	fig, nstage = draw_graph(vle_data, xF, xD, xB, R, q, max_stages)
 
-	# Return the encoded graph and the number of stages required to the user
-	if nstage < 100:
-		return serve_graph(), nstage
 	# Something is wrong with the parameters, return an error
-	else:
+	if fig is None:
 		return "Error", "Error"
+
+	# Return the encoded graph and the number of stages required to the user
+	return serve_graph(fig), nstage
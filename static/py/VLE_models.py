@@ -0,0 +1,407 @@
+# ***************************************************************************
+# * Distillation Column Calculation - VLE_models.py
+# * Spencer Wagner
+# *
+# * Equilibrium curve models that are built once per dataset and can be
+# * evaluated and inverted exactly at any liquid mole fraction, without
+# * relying on a fixed grid
+# ***************************************************************************
+from collections import namedtuple
+import math
+
+import numpy as np
+
+# Points of the grid a model is sampled on for drawing
+PLOT_POINTS = 1000
+
+
+class PchipCurve(namedtuple('PchipCurve', ['x', 'y', 'knots_x', 'knots_y', 'slopes', 'knots_max'])):
+	"""
+	Monotone piecewise cubic Hermite interpolant (PCHIP) of a dataset. It
+	passes through every point, never overshoots between them and stays in
+	[0, 1], unlike a high-degree polynomial fitted to a few points
+	  x, y      - grid sampled for drawing
+	  knots_x   - liquid mole fractions of the points, sorted
+	  knots_y   - vapor mole fractions of the points
+	  slopes    - derivative of the curve at each point
+	  knots_max - running maximum of knots_y, used for inversion
+	"""
+	__slots__ = ()
+
+	def evaluate(self, x):
+		"""
+		Vapor mole fraction at liquid mole fraction x, a number or an array
+		"""
+		x = np.clip(x, self.knots_x[0], self.knots_x[-1])
+		index = np.clip(np.searchsorted(self.knots_x, x, side='right') - 1, 0, len(self.knots_x) - 2)
+
+		return _hermite(self, index, x)
+
+	def invert(self, y):
+		"""
+		Liquid mole fraction of the first point of the curve with a vapor
+		mole fraction of at least y, or None if the curve never gets there
+		"""
+		# Each cubic only runs between its two knots, so the first knot at or
+		# above y ends the piece where the curve first reaches it
+		k = int(np.searchsorted(self.knots_max, y, side='left'))
+		if k == len(self.knots_max):
+			return None
+		if k == 0:
+			return float(self.knots_x[0])
+
+		return _solve_piece(self, k - 1, y)
+
+	def envelope(self):
+		"""
+		Grid sampled for drawing and the running maximum of the curve on it,
+		the curve as stepping sees it
+		"""
+		return self.x, np.maximum.accumulate(self.y)
+
+
+def pchip_slopes(x, y):
+	"""
+	Derivatives at the knots that keep the interpolant monotone wherever the
+	data is (Fritsch and Carlson), with the same end conditions as SciPy's
+	PchipInterpolator
+	"""
+	h = np.diff(x)
+	delta = np.diff(y) / h
+	slopes = np.zeros_like(y)
+
+	if len(x) == 2:
+		slopes[:] = delta[0]
+		return slopes
+
+	# Weighted harmonic mean of the secants, zero at local extrema
+	w1 = 2 * h[1:] + h[:-1]
+	w2 = h[1:] + 2 * h[:-1]
+	same_sign = delta[:-1] * delta[1:] > 0
+	with np.errstate(divide='ignore', invalid='ignore'):
+		harmonic = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+	slopes[1:-1] = np.where(same_sign, harmonic, 0.0)
+
+	slopes[0] = _end_slope(h[0], h[1], delta[0], delta[1])
+	slopes[-1] = _end_slope(h[-1], h[-2], delta[-1], delta[-2])
+
+	return slopes
+
+
+def _end_slope(h0, h1, delta0, delta1):
+	"""
+	Three-point estimate of the slope at an end, limited to stay monotone
+	"""
+	slope = ((2 * h0 + h1) * delta0 - h0 * delta1) / (h0 + h1)
+
+	if np.sign(slope) != np.sign(delta0):
+		return 0.0
+	if np.sign(delta0) != np.sign(delta1) and abs(slope) > abs(3 * delta0):
+		return 3 * delta0
+
+	return slope
+
+
+def _hermite(curve, index, x):
+	"""
+	Evaluates the cubic of each piece index at x
+	"""
+	x0 = curve.knots_x[index]
+	h = curve.knots_x[index + 1] - x0
+	t = (x - x0) / h
+	t2 = t * t
+	t3 = t2 * t
+
+	return (2 * t3 - 3 * t2 + 1) * curve.knots_y[index] + \
+		(t3 - 2 * t2 + t) * h * curve.slopes[index] + \
+		(-2 * t3 + 3 * t2) * curve.knots_y[index + 1] + \
+		(t3 - t2) * h * curve.slopes[index + 1]
+
+
+def _solve_piece(curve, index, y):
+	"""
+	Liquid mole fraction where the rising piece index reaches y, by Newton's
+	method kept inside a shrinking bracket
+	"""
+	low, high = float(curve.knots_x[index]), float(curve.knots_x[index + 1])
+	x0, h = low, high - low
+	y0, y1 = curve.knots_y[index], curve.knots_y[index + 1]
+	d0, d1 = curve.slopes[index] * h, curve.slopes[index + 1] * h
+
+	# Start from the straight line between the knots
+	x = low + (y - y0) / (y1 - y0) * h
+	for _ in range(50):
+		t = (x - x0) / h
+		t2 = t * t
+		value = (2 * t * t2 - 3 * t2 + 1) * y0 + (t * t2 - 2 * t2 + t) * d0 + \
+			(-2 * t * t2 + 3 * t2) * y1 + (t * t2 - t2) * d1 - y
+		if value < 0:
+			low = x
+		else:
+			high = x
+		if abs(value) < 1e-14 or high - low < 1e-15:
+			break
+
+		# Bisect whenever Newton would leave the bracket
+		derivative = ((6 * t2 - 6 * t) * (y0 - y1) + (3 * t2 - 4 * t + 1) * d0 + (3 * t2 - 2 * t) * d1) / h
+		if derivative > 0 and low < x - value / derivative < high:
+			x = x - value / derivative
+		else:
+			x = (low + high) / 2
+
+	return x
+
+
+def fit_pchip(vle_data):
+	"""
+	Builds the PCHIP model of a dataset. Repeated liquid mole fractions are
+	averaged, and the pure components (0, 0) and (1, 1) are added when the
+	data stops short of them
+	"""
+	points = np.asarray(vle_data, dtype=float)
+	points = points[np.isfinite(points[:, 0]) & np.isfinite(points[:, 1])]
+	x = np.clip(points[:, 0], 0, 1)
+	y = np.clip(points[:, 1], 0, 1)
+
+	knots_x, inverse = np.unique(x, return_inverse=True)
+	knots_y = np.bincount(inverse, weights=y) / np.bincount(inverse)
+
+	if knots_x[0] > 0:
+		knots_x, knots_y = np.insert(knots_x, 0, 0.0), np.insert(knots_y, 0, 0.0)
+	if knots_x[-1] < 1:
+		knots_x, knots_y = np.append(knots_x, 1.0), np.append(knots_y, 1.0)
+
+	slopes = pchip_slopes(knots_x, knots_y)
+	curve = PchipCurve(None, None, knots_x, knots_y, slopes, np.maximum.accumulate(knots_y))
+
+	x_plot = np.linspace(0, 1, PLOT_POINTS)
+	return curve._replace(x=x_plot, y=curve.evaluate(x_plot))
+
+
+###############################################################################
+# ANALYTIC MODELS
+###############################################################################
+# y = alpha x gamma1 / (alpha x gamma1 + (1 - x) gamma2), modified Raoult's
+# law with a constant ratio alpha of the pure component vapor pressures and
+# activity coefficients from the model. Parameters of each model, in order
+ANALYTIC_MODELS = {
+	'alpha': ('alpha',),
+	'margules': ('alpha', 'A12', 'A21'),
+	'van_laar': ('alpha', 'A12', 'A21')
+}
+
+# Points of the grid that brackets the inversion of a model
+BRACKET_POINTS = 257
+
+
+class AnalyticCurve(namedtuple('AnalyticCurve', ['x', 'y', 'model', 'params', 'grid_x', 'grid_max'])):
+	"""
+	Equilibrium curve given by one of ANALYTIC_MODELS
+	  x, y             - grid sampled for drawing
+	  model, params    - model name and its parameters by name
+	  grid_x, grid_max - coarse grid and running maximum of the curve on it,
+	                     used to bracket the inversion
+	"""
+	__slots__ = ()
+
+	def evaluate(self, x):
+		"""
+		Vapor mole fraction at liquid mole fraction x, a number or an array
+		"""
+		return model_y(self.model, self.params, x)[0]
+
+	def invert(self, y):
+		"""
+		Liquid mole fraction of the first point of the curve with a vapor
+		mole fraction of at least y, or None if the curve never gets there
+		"""
+		if y <= 0:
+			return 0.0
+
+		# Constant relative volatility inverts in closed form
+		if self.model == 'alpha':
+			if y > 1:
+				return None
+			alpha = self.params['alpha']
+			return y / (alpha - (alpha - 1) * y)
+
+		k = int(np.searchsorted(self.grid_max, y, side='left'))
+		if k == len(self.grid_max):
+			return None
+		if k == 0:
+			return 0.0
+
+		return self._solve(float(self.grid_x[k - 1]), float(self.grid_x[k]), float(y))
+
+	def envelope(self):
+		"""
+		Grid sampled for drawing and the running maximum of the curve on it,
+		the curve as stepping sees it
+		"""
+		return self.x, np.maximum.accumulate(self.y)
+
+	def _solve(self, low, high, y):
+		"""
+		Liquid mole fraction where the curve reaches y between low and high,
+		by Newton's method kept inside the bracket
+		"""
+		x = (low + high) / 2
+		for _ in range(50):
+			value, slope = model_y(self.model, self.params, x)
+			value -= y
+			if value < 0:
+				low = x
+			else:
+				high = x
+			if abs(value) < 1e-14 or high - low < 1e-15:
+				break
+
+			# Bisect whenever Newton would leave the bracket
+			if slope > 0 and low < x - value / slope < high:
+				x = x - value / slope
+			else:
+				x = (low + high) / 2
+
+		return float(x)
+
+
+def ln_gamma(model, params, x):
+	"""
+	Natural logs of the activity coefficients of both components at liquid
+	mole fraction x and their derivatives with respect to x. x is a float
+	or an array
+	"""
+	x1 = x
+	x2 = 1 - x1
+
+	if model == 'margules':
+		A12, A21 = params['A12'], params['A21']
+		lng1 = x2 ** 2 * (A12 + 2 * (A21 - A12) * x1)
+		lng2 = x1 ** 2 * (A21 + 2 * (A12 - A21) * x2)
+		dlng1 = -2 * x2 * (A12 + 2 * (A21 - A12) * x1) + 2 * (A21 - A12) * x2 ** 2
+		dlng2 = 2 * x1 * (A21 + 2 * (A12 - A21) * x2) - 2 * (A12 - A21) * x1 ** 2
+		return lng1, lng2, dlng1, dlng2
+
+	if model == 'van_laar':
+		A12, A21 = params['A12'], params['A21']
+		D = A12 * x1 + A21 * x2
+		lng1 = A12 * (A21 * x2 / D) ** 2
+		lng2 = A21 * (A12 * x1 / D) ** 2
+		dlng1 = -2 * A12 ** 2 * A21 ** 2 * x2 / D ** 3
+		dlng2 = 2 * A12 ** 2 * A21 ** 2 * x1 / D ** 3
+		return lng1, lng2, dlng1, dlng2
+
+	zero = 0 * x1
+	return zero, zero, zero, zero
+
+
+def model_y(model, params, x):
+	"""
+	Vapor mole fraction of a model at liquid mole fraction x and its
+	derivative with respect to x
+	"""
+	# Single values skip numpy's overhead, inversion evaluates one at a time
+	if isinstance(x, float):
+		x1, exp = x, math.exp
+	else:
+		x1, exp = np.asarray(x, dtype=float), np.exp
+
+	lng1, lng2, dlng1, dlng2 = ln_gamma(model, params, x1)
+	gamma1, gamma2 = exp(lng1), exp(lng2)
+
+	a = params['alpha'] * x1 * gamma1
+	b = (1 - x1) * gamma2
+	da = params['alpha'] * gamma1 * (1 + x1 * dlng1)
+	db = gamma2 * (-1 + (1 - x1) * dlng2)
+
+	return a / (a + b), (da * b - a * db) / (a + b) ** 2
+
+
+def analytic_curve(model, params):
+	"""
+	Builds the curve of a model from its parameters by name
+	"""
+	if model not in ANALYTIC_MODELS:
+		raise ValueError('Unknown model {!r}, use one of: {}'.format(model, ', '.join(ANALYTIC_MODELS)))
+	params = {name: float(params[name]) for name in ANALYTIC_MODELS[model]}
+	if not params['alpha'] > 0:
+		raise ValueError('alpha must be positive')
+
+	grid_x = np.linspace(0, 1, BRACKET_POINTS)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		grid_y = model_y(model, params, grid_x)[0]
+	if not np.all(np.isfinite(grid_y)):
+		raise ValueError('The {} parameters give an undefined curve'.format(model))
+
+	x_plot = np.linspace(0, 1, PLOT_POINTS)
+	return AnalyticCurve(x_plot, model_y(model, params, x_plot)[0], model, params,
+		grid_x, np.maximum.accumulate(grid_y))
+
+
+def fit_analytic(model, vle_data):
+	"""
+	Fits the parameters of a model to a dataset by least squares on the
+	vapor mole fractions (Levenberg-Marquardt). Returns the parameters by
+	name
+	"""
+	points = np.asarray(vle_data, dtype=float)
+	points = points[np.isfinite(points[:, 0]) & np.isfinite(points[:, 1])]
+	x, y = points[:, 0], points[:, 1]
+	names = ANALYTIC_MODELS[model]
+
+	# Start from the median relative volatility of the interior points and
+	# an ideal liquid. alpha is fitted as its log to keep it positive
+	interior = (x > 0) & (x < 1) & (y > 0) & (y < 1)
+	alpha = np.median(y[interior] * (1 - x[interior]) / (x[interior] * (1 - y[interior]))) if interior.any() else 1.0
+	start = {'alpha': np.log(alpha), 'A12': 0.1, 'A21': 0.1}
+	theta = np.array([start[name] for name in names])
+
+	def residuals(theta):
+		params = dict(zip(names, theta))
+		params['alpha'] = np.exp(params['alpha'])
+		with np.errstate(all='ignore'):
+			return model_y(model, params, x)[0] - y
+
+	damping = 1e-3
+	error = residuals(theta)
+	cost = error @ error
+	for _ in range(200):
+		# Forward difference Jacobian
+		jacobian = np.empty((len(x), len(theta)))
+		for j in range(len(theta)):
+			step = 1e-7 * max(1.0, abs(theta[j]))
+			shifted = theta.copy()
+			shifted[j] += step
+			jacobian[:, j] = (residuals(shifted) - error) / step
+
+		normal = jacobian.T @ jacobian
+		gradient = jacobian.T @ error
+		improved = False
+		while damping < 1e10:
+			try:
+				delta = np.linalg.solve(normal + damping * np.diag(np.diag(normal) + 1e-12), -gradient)
+			except np.linalg.LinAlgError:
+				damping *= 10
+				continue
+			trial = residuals(theta + delta)
+			trial_cost = trial @ trial
+			if np.isfinite(trial_cost) and trial_cost < cost:
+				theta, error, improved = theta + delta, trial, cost - trial_cost > 1e-15 * cost
+				cost = trial_cost
+				damping = max(damping / 10, 1e-12)
+				break
+			damping *= 10
+
+		if not improved:
+			break
+
+	params = dict(zip(names, theta.tolist()))
+	params['alpha'] = float(np.exp(params['alpha']))
+	return params
+
+
+def fit_analytic_curve(model, vle_data):
+	"""
+	Fits a model to a dataset and builds its curve
+	"""
+	return analytic_curve(model, fit_analytic(model, vle_data))
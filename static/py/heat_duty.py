@@ -2,8 +2,53 @@
 # * Distillation Column Calculation - heat_duty.py
 # * Spencer Wagner
 # *
-# * Functions for calculating heat duty for running a built column
+# * Functions for calculating heat duty for running a built column. Every
+# * function takes scalars or NumPy arrays, so whole sweeps over stages,
+# * reflux ratios or temperatures are priced in one call
 # ***************************************************************************
+from collections import namedtuple
+
+import numpy as np
+
+# Plant data of the 2019 ethanol-water design memo, the defaults of the cost
+# model
+#   D_rate     - distillate produced, lb/day
+#   MW_A, MW_B - molecular weights of the light and heavy component, lb/lbmol
+#   CP_A, CP_B - liquid heat capacities, BTU/lbmol F
+#   Hvap       - heat of vaporization, BTU/lbmol
+#   TF         - feed temperature, F
+#   TB         - bubble point of the feed, F, for q_val
+#   efficiency - tray efficiency
+PLANT_DEFAULTS = {
+    'D_rate': 48000.0,
+    'MW_A': 46.07,
+    'MW_B': 18.02,
+    'CP_A': 0.548 * 46.07,
+    'CP_B': 1 * 18.02,
+    'Hvap': 17000.0,
+    'TF': 140.0,
+    'TB': 197.3,
+    'efficiency': 0.671
+}
+
+# Break-even cost of a column over 3 years in $/1000 lb of distillate, by
+# part. capital and operating are the sums of the parts before them, total
+# is their sum
+CostBreakdown = namedtuple('CostBreakdown', [
+    'tray', 'shell', 'feed_HX', 'reboiler', 'condenser',
+    'steam', 'cooling_water', 'feed',
+    'capital', 'operating', 'total'
+])
+
+
+def _select(condition, if_true, if_false):
+    """
+    np.where that gives back a plain number when the inputs are scalars
+    """
+    value = np.where(condition, if_true, if_false)
+
+    return value if value.ndim else value.item()
+
 
 ####################################################################
 # Functions for calculating the costs of various parts of the tower
@@ -11,13 +56,11 @@
 # Tray price for carbon steel sieve trays & one mist eliminator
 def tray_price(nstage):
     ntrays = nstage - 1
+    valve_factor = 1.2
 
-    if ntrays < 20 and ntrays > 9:
-        price = 1.2 * 4750.53 * (ntrays + 0.8333)
-
-    else:
-        valve_factor = 1.2
-        price = valve_factor * 3167.02 * (ntrays + 0.8333)
+    price = _select((ntrays < 20) & (ntrays > 9),
+                    1.2 * 4750.53 * (ntrays + 0.8333),
+                    valve_factor * 3167.02 * (ntrays + 0.8333))
 
     return price
 
@@ -32,23 +75,20 @@ def shell_price(nstage):
 
 
 # Extra HX for feed preheating cost
+# No exchanger is needed for feeds at or below 86 F
 def feed_HX_price(TF, F, zF, CP_A, CP_B, Hvap):
-    if TF <= 86.0:
-        price = 0
-        G_cond = 0
-
-    else:
-        Q_HX = F * (CP_A * zF + CP_B * (1 - zF)) * (TF - 86.0)
+    Q_HX = F * (CP_A * zF + CP_B * (1 - zF)) * (TF - 86.0)
 
+    # Both branches are evaluated for arrays, the log mean is undefined at 86 F
+    with np.errstate(divide='ignore', invalid='ignore'):
         delta_T1 = 173.1 - TF
         delta_T2 = 173.1 - 86
         delta_Tlm = (delta_T1 - delta_T2) / (np.log((delta_T1 / delta_T2)))
 
-        area = Q_HX / (100 * delta_Tlm)
-
-        G_cond = Q_HX / Hvap
         cost_scaling = (535.5 / 355) * 5
-        price = cost_scaling * 10000 * (Q_HX / (625 * 100 * delta_Tlm)) ** 0.7
+        heated = TF > 86.0
+        G_cond = _select(heated, Q_HX / Hvap, 0)
+        price = _select(heated, cost_scaling * 10000 * (Q_HX / (625 * 100 * delta_Tlm)) ** 0.7, 0)
 
     return G_cond, price
 
@@ -114,3 +154,65 @@ def feed_price(F, zF, MW_A, MW_B):
     price = F_lb * 0.020  # Dollars/3yrs
 
     return price
+
+
+# Quality q of a feed at TF heated to its bubble point TB, both in F
+def q_val(zF, CP_A, CP_B, TB, TF, Hvap=17000.0):
+    q = 1 + (zF * CP_A + (1 - zF) * CP_B) * (TB - TF) / Hvap
+
+    return q
+
+
+# Distillate, bottoms and feed flow rates in lbmol/hr for D_rate lb/day of
+# distillate
+def flow_rates(D_rate, xD, zF, xW, MW_A, MW_B):
+    D = D_rate / (MW_A * xD + MW_B * (1 - xD)) / 24  # lbmol/hr
+    W = D * (zF - xD) / (xW - zF)  # lbmol/hr
+    F = D + W  # lbmol/hr
+
+    return D, W, F
+
+
+# Break-even cost of the column as in the design memo, returns a
+# CostBreakdown. nstage is the number of real stages and Tw the temperature
+# of the bottom stage in K, any of the arguments may be arrays
+def break_even_cost(nstage, R, q, Tw, xD, zF, xW, TF=140.0, D_rate=48000.0, MW_A=46.07,
+                    MW_B=18.02, CP_A=0.548 * 46.07, CP_B=1 * 18.02, Hvap=17000.0):
+    D, W, F = flow_rates(D_rate, xD, zF, xW, MW_A, MW_B)
+
+    tray_cost = tray_price(nstage)
+    shell_cost = shell_price(nstage)
+    G_condensed, feed_HX_cost = feed_HX_price(TF, F, zF, CP_A, CP_B, Hvap)
+    Q_reboiler, reboiler_cost = reboiler_price(D, F, R, q, Hvap, Tw)
+    Q_condenser, condenser_cost = condenser_price(D, G_condensed, R, Hvap)
+    steam_cost = steam_price(Q_reboiler)
+    cooling_water_cost = cooling_water_price(Q_condenser)
+    feed_cost = feed_price(F, zF, MW_A, MW_B)
+
+    # Divide by the distillate produced over 3 years for $/1000 lb distillate
+    per_1000lb = D_rate * 360 * 3 / 1000
+    capital_cost = (tray_cost + shell_cost + reboiler_cost + condenser_cost +
+                    feed_HX_cost) / per_1000lb
+    operational_cost = (steam_cost + cooling_water_cost + feed_cost) / per_1000lb
+
+    return CostBreakdown(
+        tray_cost / per_1000lb, shell_cost / per_1000lb, feed_HX_cost / per_1000lb,
+        reboiler_cost / per_1000lb, condenser_cost / per_1000lb,
+        steam_cost / per_1000lb, cooling_water_cost / per_1000lb, feed_cost / per_1000lb,
+        capital_cost, operational_cost, capital_cost + operational_cost
+    )
+
+
+# Returns a message describing why the plant data can't be costed, or None
+# if it can
+def check_plant(plant):
+    if not all(np.isfinite(value) for value in plant.values()):
+        return 'Every plant parameter must be a number'
+    if not 0 < plant['efficiency'] <= 1:
+        return 'Tray efficiency must satisfy 0 < efficiency <= 1'
+    if min(plant['D_rate'], plant['MW_A'], plant['MW_B'], plant['Hvap']) <= 0:
+        return 'D_rate, MW_A, MW_B and Hvap must be positive'
+    if plant['TF'] >= 173.1:
+        return 'Feed temperature must be below the 173.1 F of the preheater steam'
+
+    return None
@@ -0,0 +1,253 @@
+# ***************************************************************************
+# * Distillation Column Calculation - optimize.py
+# * Spencer Wagner
+# *
+# * Finds the reflux ratio with the lowest break-even cost. The number of
+# * stages only changes at a few reflux ratios, so those breakpoints are
+# * found by bisection and the cost between them is priced without stepping
+# ***************************************************************************
+import heapq
+import math
+from collections import namedtuple
+
+import numpy as np
+
+import static.py.heat_duty as heat_duty
+import static.py.VLE_graph as vle
+
+# Golden ratio conjugate, the fraction a bounded search keeps each iteration
+INVERSE_PHI = (math.sqrt(5) - 1) / 2
+
+# A reflux ratio the stages were stepped off at
+#   R      - reflux ratio
+#   nstage - number of theoretical stages, nan if the stepping did not
+#            converge
+#   Tw     - temperature of the bottom stage in K, nan if it did not converge
+RefluxPoint = namedtuple('RefluxPoint', ['R', 'nstage', 'Tw'])
+
+# Result of optimize_reflux
+#   R, nstage, Tw - reflux ratio with the lowest cost and its stepping
+#   costs         - CostBreakdown at R
+#   breakpoints   - (R_below, R_above, nstage_below, nstage_above) around
+#                   every change in the stage count, as narrow as the curve
+#                   resolution, or tol where the change could hold the optimum
+#   curve         - R, nstage and the capital, operating and total costs at
+#                   evenly spaced reflux ratios for plotting, nan where the
+#                   stepping did not converge
+#   evaluations   - number of reflux ratios the stages were stepped off at
+RefluxOptimum = namedtuple('RefluxOptimum',
+	['R', 'nstage', 'Tw', 'costs', 'breakpoints', 'curve', 'evaluations'])
+
+# Result of the joint optimization over R and the feed temperature
+#   TF, q     - feed temperature with the lowest cost and its q from q_val
+#   reflux    - RefluxOptimum at TF
+#   feeds     - (TF, q, R, nstage, total) of the cheapest reflux ratio at
+#               every feed temperature tried, in order of TF
+#   steppings - number of times the stages were stepped off, results
+#               cached from earlier optimizations are not counted
+FeedOptimum = namedtuple('FeedOptimum', ['TF', 'q', 'reflux', 'feeds', 'steppings'])
+
+
+def column_cost(nstage, R, q, Tw, xF, xD, xB, plant):
+	"""
+	CostBreakdown of a column with nstage theoretical stages, plant holds
+	the keys of heat_duty.PLANT_DEFAULTS. Every argument but plant may be an
+	array, a nan stage count gives nan costs
+	"""
+	costs = {name: value for name, value in plant.items() if name not in ('efficiency', 'TB')}
+
+	nstage_real = vle.calc_nstages(nstage, plant['efficiency'])
+	with np.errstate(invalid='ignore'):
+		return heat_duty.break_even_cost(nstage_real, R, q, Tw, xD, xF, xB, **costs)
+
+
+def total_cost(costs):
+	"""
+	Total cost as a float, infinite when the column can't be priced
+	"""
+	total = float(costs.total)
+
+	return total if math.isfinite(total) else math.inf
+
+
+def _same_count(nstage1, nstage2):
+	"""
+	True if both stage counts are equal or both did not converge
+	"""
+	return nstage1 == nstage2 or (math.isnan(nstage1) and math.isnan(nstage2))
+
+
+def golden_section(func, a, b, tol):
+	"""
+	Minimizes func on [a, b] assuming it has a single minimum there,
+	returns the minimizer found once the bracket is narrower than tol
+	"""
+	c = b - INVERSE_PHI * (b - a)
+	d = a + INVERSE_PHI * (b - a)
+	fc, fd = func(c), func(d)
+
+	while b - a > tol:
+		if fc < fd:
+			b, d, fd = d, c, fc
+			c = b - INVERSE_PHI * (b - a)
+			fc = func(c)
+		else:
+			a, c, fc = c, d, fd
+			d = a + INVERSE_PHI * (b - a)
+			fd = func(d)
+
+	return (a + b) / 2
+
+
+def optimize_reflux(step, bottom_temperature, xF, xD, xB, q, plant, R_min, R_max, points=100, tol=1e-4,
+		max_stages=vle.MAX_STAGES):
+	"""
+	Finds the reflux ratio between R_min and R_max with the lowest
+	break-even cost. step(R) returns the StageResult of the design at R and
+	bottom_temperature(x) the temperature in K of a bottom stage with
+	liquid mole fraction x.
+
+	The stage count never grows with R. It is found at points evenly spaced
+	reflux ratios by bisecting only where it changes. Between changes, the
+	cost is priced without stepping, with Tw interpolated. Only the changes
+	whose lower bound beats the best cost found are narrowed down to tol.
+	Stage counts of max_stages or more did not converge. Returns a
+	RefluxOptimum
+	"""
+	evaluated = {}
+
+	def evaluate(R):
+		if R not in evaluated:
+			result = step(R)
+			if result.nstage >= max_stages:
+				evaluated[R] = RefluxPoint(R, math.nan, math.nan)
+			else:
+				evaluated[R] = RefluxPoint(R, result.nstage, float(bottom_temperature(result.x[-1])))
+
+		return evaluated[R]
+
+	def cost(nstage, R, Tw):
+		return column_cost(nstage, R, q, Tw, xF, xD, xB, plant)
+
+	# Stage count at every point of the curve, stepped off only at the ends
+	# of the runs where it is constant
+	R_grid = np.linspace(R_min, R_max, points)
+	nstage = np.full(points, math.nan)
+	nstage[0] = evaluate(R_grid[0]).nstage
+	nstage[-1] = evaluate(R_grid[-1]).nstage
+	segments = [(0, points - 1)]
+
+	while segments:
+		start, end = segments.pop()
+		if _same_count(nstage[start], nstage[end]):
+			nstage[start:end + 1] = nstage[start]
+		elif end - start > 1:
+			middle = (start + end) // 2
+			nstage[middle] = evaluate(R_grid[middle]).nstage
+			segments += [(start, middle), (middle, end)]
+
+	# Tw between the stepped off reflux ratios is interpolated
+	feasible = sorted(point for point in evaluated.values() if not math.isnan(point.nstage))
+	if not feasible:
+		raise ValueError('The stages do not converge at any reflux ratio between R_min and R_max')
+
+	def temperature(R):
+		return np.interp(R, [point.R for point in feasible], [point.Tw for point in feasible])
+
+	curve_costs = cost(nstage, R_grid, temperature(R_grid))
+	curve_total = np.where(np.isfinite(curve_costs.total), curve_costs.total, math.inf)
+
+	# Best cost so far as (total, R), stepped off points are priced exactly
+	best = min((total_cost(cost(point.nstage, point.R, point.Tw)), point.R) for point in feasible)
+
+	# Between the stepped off points, the lowest interpolated cost of the
+	# curve is refined with a bounded search over its run of constant stages
+	index = int(np.argmin(curve_total))
+	if curve_total[index] < best[0] and 0 < index < points - 1 and \
+			_same_count(nstage[index - 1], nstage[index + 1]):
+		R = golden_section(lambda R: total_cost(cost(nstage[index], R, temperature(R))),
+			R_grid[index - 1], R_grid[index + 1], tol)
+		point = evaluate(R)
+		best = min(best, (total_cost(cost(point.nstage, R, point.Tw)), R))
+
+	# Narrow the changes in stage count that could hold the optimum. Fewer
+	# stages are cheaper to build, so a change can only beat the best cost
+	# right above it: its lower bound prices every stage count it spans at
+	# the reflux ratio and temperature below it
+	def lower_bound(below, above):
+		if math.isnan(above.nstage):
+			return math.inf
+		highest = below.nstage if not math.isnan(below.nstage) else max_stages - 1
+		counts = np.arange(above.nstage, highest + 1)
+		total = cost(counts, below.R, np.nanmin([below.Tw, above.Tw])).total
+
+		return float(np.min(np.where(np.isfinite(total), total, math.inf)))
+
+	changes = []
+	for start in range(points - 1):
+		if not _same_count(nstage[start], nstage[start + 1]):
+			below, above = evaluate(R_grid[start]), evaluate(R_grid[start + 1])
+			heapq.heappush(changes, (lower_bound(below, above), below, above))
+
+	while changes and changes[0][0] < best[0]:
+		_, below, above = heapq.heappop(changes)
+		if above.R - below.R <= tol:
+			continue
+
+		middle = evaluate((below.R + above.R) / 2)
+		if not math.isnan(middle.nstage):
+			best = min(best, (total_cost(cost(middle.nstage, middle.R, middle.Tw)), middle.R))
+		for pair in ((below, middle), (middle, above)):
+			if not _same_count(pair[0].nstage, pair[1].nstage):
+				heapq.heappush(changes, (lower_bound(*pair), *pair))
+
+	if math.isinf(best[0]):
+		raise ValueError('No reflux ratio between R_min and R_max gives a column that can be priced')
+
+	optimum = evaluated[best[1]]
+
+	# Changes in stage count between neighbouring stepped off points
+	ordered = sorted(evaluated.values())
+	breakpoints = [(below.R, above.R, below.nstage, above.nstage)
+		for below, above in zip(ordered, ordered[1:]) if not _same_count(below.nstage, above.nstage)]
+
+	curve = {'R': R_grid, 'nstage': nstage}
+	for name in ('capital', 'operating', 'total'):
+		curve[name] = np.where(np.isnan(nstage), math.nan, getattr(curve_costs, name))
+
+	return RefluxOptimum(optimum.R, optimum.nstage, optimum.Tw,
+		cost(optimum.nstage, optimum.R, optimum.Tw), breakpoints, curve, len(evaluated))
+
+
+def feed_quality(TF, xF, plant):
+	"""
+	q of a feed at TF with the heat capacities and bubble point of plant
+	"""
+	return heat_duty.q_val(xF, plant['CP_A'], plant['CP_B'], plant['TB'], TF, plant['Hvap'])
+
+
+def optimize_feed(curve, profile, xF, xD, xB, TF, plant, R_min, R_max, points=100, tol=1e-4, steps=None,
+		max_stages=vle.MAX_STAGES):
+	"""
+	Finds the cheapest reflux ratio for a feed at TF, with q from q_val.
+	profile is the (x, T) the temperature of the bottom stage is
+	interpolated from. steps holds the StageResult of reflux ratios already
+	stepped off on the q-line of TF, keyed by R. Returns the RefluxOptimum
+	and steps with the new results added. Runs in the process pool. Raises
+	ValueError for a feed at its bubble point, whose q line is vertical
+	"""
+	q = feed_quality(TF, xF, plant)
+	if q == 1:
+		raise ValueError('A feed at its bubble point gives a vertical q line')
+	steps = dict(steps or {})
+
+	def step(R):
+		if R not in steps:
+			steps[R] = vle.calc_stages(curve, xF, xD, xB, R, q, max_stages)
+
+		return steps[R]
+
+	optimum = optimize_reflux(step, lambda x: np.interp(x, *profile), xF, xD, xB, q,
+		dict(plant, TF=TF), R_min, R_max, points, tol, max_stages)
+
+	return optimum, steps
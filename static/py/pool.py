@@ -0,0 +1,57 @@
+# ***************************************************************************
+# * Distillation Column Calculation - pool.py
+# * Spencer Wagner
+# *
+# * Process pools for the calculations too large to run in a request thread
+# ***************************************************************************
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+import multiprocessing
+import os
+
+_pools = {}
+_pool_lock = Lock()
+
+
+def pool_size():
+	"""
+	Number of calculation worker processes, CALC_WORKERS or one per CPU
+	"""
+	return int(os.getenv('CALC_WORKERS', os.cpu_count() or 1))
+
+
+def get_pool(name='calc', size=None):
+	"""
+	Returns the named process pool, starting it on first use. Workers are
+	spawned rather than forked so they don't inherit the web worker's
+	threads, locks or database connections
+	"""
+	with _pool_lock:
+		if name not in _pools:
+			_pools[name] = ProcessPoolExecutor(
+				max_workers=size or pool_size(),
+				mp_context=multiprocessing.get_context('spawn')
+			)
+
+		return _pools[name]
+
+
+def reset_pool(name='calc'):
+	"""
+	Drops the named pool, after a worker died and broke it, so the next
+	get_pool starts a new one
+	"""
+	with _pool_lock:
+		pool = _pools.pop(name, None)
+
+	if pool is not None:
+		pool.shutdown(wait=False)
+
+
+def chunk(items, nchunks):
+	"""
+	Splits items into at most nchunks lists of nearly equal length
+	"""
+	size = -(-len(items) // max(nchunks, 1))
+
+	return [items[i:i + size] for i in range(0, len(items), size)]
@@ -0,0 +1,12 @@
+# ***************************************************************************
+# * Distillation Column Calculation - conftest.py
+# * Spencer Wagner
+# *
+# * Puts the repository root on the import path so the tests can be run
+# * with a plain `pytest` from anywhere in the tree
+# ***************************************************************************
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
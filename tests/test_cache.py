@@ -0,0 +1,174 @@
+# ***************************************************************************
+# * Distillation Column Calculation - test_cache.py
+# * Spencer Wagner
+# *
+# * The stores for rendered graphs: keys, hits and misses, and eviction of
+# * the least recently used graphs. Redis is replaced by a dict-backed client
+# ***************************************************************************
+import os
+
+import pytest
+
+import database.cache as cache
+from database.cache import MemoryStore, FileStore, RedisStore, make_graph_store
+from database.cache import graph_key, pack_graph, unpack_graph
+
+
+class FakeRedis:
+	"""
+	Stands in for a redis.Redis client, remembering the expiry of each key
+	"""
+	def __init__(self):
+		self.data = {}
+		self.expiry = {}
+
+	def get(self, key):
+		return self.data.get(key)
+
+	def set(self, key, value, ex=None):
+		self.data[key] = value
+		self.expiry[key] = ex
+
+
+def age(store, key, seconds):
+	"""
+	Makes the file of key in a FileStore look seconds old
+	"""
+	path = os.path.join(store.directory, key)
+	mtime = os.stat(path).st_mtime - seconds
+	os.utime(path, (mtime, mtime))
+
+
+def test_graph_key_hashes_every_input():
+	key = graph_key(1, 2, 7, 'fit', 0.3, 0.8, 0.05, 3.0, 0.5, 'png')
+
+	assert key == graph_key(1, 2, 7, 'fit', 0.3, 0.8, 0.05, 3.0, 0.5, 'png')
+	assert len(key) == 64 and int(key, 16) >= 0
+
+	# A new dataset version or format is a new graph
+	assert key != graph_key(1, 2, 8, 'fit', 0.3, 0.8, 0.05, 3.0, 0.5, 'png')
+	assert key != graph_key(1, 2, 7, 'fit', 0.3, 0.8, 0.05, 3.0, 0.5, 'svg')
+
+
+def test_pack_graph_round_trip():
+	image = b'\x89PNG\r\n\x1a\n\x00 two\nlines'
+
+	assert unpack_graph(pack_graph(image, 12)) == (image, 12)
+
+
+def test_memory_store_hits_and_misses():
+	store = MemoryStore(1024)
+
+	assert store.get('a') is None
+	store.set('a', b'graph')
+	assert store.get('a') == b'graph'
+
+	stats = store.stats()
+	assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 5)
+
+
+def test_memory_store_evicts_least_recently_used_bytes():
+	store = MemoryStore(250)
+	store.set('a', b'a' * 100)
+	store.set('b', b'b' * 100)
+
+	# Reading a makes b the least recently used
+	assert store.get('a') is not None
+	store.set('c', b'c' * 100)
+
+	assert store.get('b') is None
+	assert store.get('a') == b'a' * 100 and store.get('c') == b'c' * 100
+	assert store.stats()['size'] == 200
+
+
+def test_file_store_hits_and_misses(tmp_path):
+	store = FileStore(str(tmp_path / 'graphs'), 1024)
+
+	assert store.get('a') is None
+	store.set('a', b'graph')
+	assert store.get('a') == b'graph'
+
+	# Another worker sharing the directory sees the graph
+	assert FileStore(store.directory, 1024).get('a') == b'graph'
+
+	stats = store.stats()
+	assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 5)
+	assert not [name for name in os.listdir(store.directory) if name.endswith('.tmp')]
+
+
+def test_file_store_evicts_least_recently_used_files(tmp_path):
+	store = FileStore(str(tmp_path), 250)
+	store.set('a', b'a' * 100)
+	store.set('b', b'b' * 100)
+	age(store, 'a', 20)
+	age(store, 'b', 10)
+
+	# Reading a touches its file, which makes b the least recently used
+	assert store.get('a') is not None
+	store.set('c', b'c' * 100)
+
+	assert sorted(os.listdir(store.directory)) == ['a', 'c']
+	assert store.stats()['size'] == 200
+
+
+def test_file_store_lists_directory_only_when_full(tmp_path, monkeypatch):
+	(tmp_path / 'old').write_bytes(b'o' * 100)
+	store = FileStore(str(tmp_path), 300)
+	assert store.size == 100
+
+	listings = []
+	scandir = os.scandir
+	monkeypatch.setattr(cache.os, 'scandir', lambda path: listings.append(path) or scandir(path))
+
+	# Replacing a graph doesn't count it twice
+	store.set('a', b'a' * 100)
+	store.set('a', b'a' * 100)
+	store.set('b', b'b' * 100)
+	assert (store.size, listings) == (300, [])
+
+	age(store, 'old', 30)
+	age(store, 'a', 20)
+	age(store, 'b', 10)
+	store.set('c', b'c' * 100)
+
+	# Over the limit, eviction goes down to EVICT_TO of it
+	assert len(listings) == 1
+	assert sorted(os.listdir(store.directory)) == ['b', 'c']
+	assert store.size == 200 <= store.max_bytes * FileStore.EVICT_TO
+
+
+def test_redis_store_prefixes_keys_and_sets_ttl():
+	client = FakeRedis()
+	store = RedisStore(client=client, ttl=60, prefix='test:')
+
+	assert store.get('a') is None
+	store.set('a', b'graph')
+	assert store.get('a') == b'graph'
+
+	assert client.data == {'test:a': b'graph'}
+	assert client.expiry == {'test:a': 60}
+
+	stats = store.stats()
+	assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_redis_store_shared_between_workers():
+	client = FakeRedis()
+	RedisStore(client=client).set('a', b'graph')
+
+	assert RedisStore(client=client).get('a') == b'graph'
+
+
+def test_make_graph_store_kinds(tmp_path):
+	assert isinstance(make_graph_store('memory', 1024), MemoryStore)
+	assert isinstance(make_graph_store('filesystem', 1024, directory=str(tmp_path)), FileStore)
+
+
+def test_make_graph_store_redis_needs_package():
+	try:
+		import redis
+	except ImportError:
+		with pytest.raises(RuntimeError):
+			make_graph_store('redis', 1024, url='redis://localhost:6379/0')
+	else:
+		assert isinstance(make_graph_store('redis', 1024, url='redis://localhost:6379/0'), RedisStore)
@@ -0,0 +1,58 @@
+# ***************************************************************************
+# * Distillation Column Calculation - test_graph_threads.py
+# * Spencer Wagner
+# *
+# * Graphs drawn from several threads at once must match the graphs drawn
+# * one at a time: same number of stages and same image bytes
+# ***************************************************************************
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import static.py.VLE_graph as vle
+
+from conftest import ROOT
+
+# Designs drawn on every bundled dataset, as (xF, xD, xB, R, q)
+DESIGNS = [
+	(0.3, 0.8, 0.05, 3.0, 0.5),
+	(0.4, 0.85, 0.1, 2.0, 1.2),
+	(0.2, 0.7, 0.02, 5.0, 0.8),
+	(0.5, 0.9, 0.2, 4.0, 0.3)
+]
+
+
+@pytest.fixture(scope='module')
+def cases():
+	"""
+	Every design on every dataset in static/files
+	"""
+	paths = sorted(glob.glob(os.path.join(ROOT, 'static', 'files', '*.csv')))
+	curves = [vle.fit_curve(pd.read_csv(path)) for path in paths]
+
+	return [(curve, design) for curve in curves for design in DESIGNS]
+
+
+def draw(case):
+	curve, design = case
+	fig, nstage = vle.draw_graph(curve, *design)
+	if fig is None:
+		return None, nstage
+
+	return vle.graph_image(fig), nstage
+
+
+def test_cases_draw_graphs(cases):
+	assert all(image is not None for image, _ in map(draw, cases))
+
+
+@pytest.mark.parametrize('threads', [2, 8])
+def test_threads_match_serial(cases, threads):
+	expected = [draw(case) for case in cases]
+
+	with ThreadPoolExecutor(threads) as executor:
+		for _ in range(3):
+			assert list(executor.map(draw, cases)) == expected